@@ -0,0 +1,42 @@
+import argparse
+import json
+import sys
+
+from benchmark.runner import compare, run_suite
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmark",
+                                     description="Per-subsystem tick cost of World of Chaos levels")
+    parser.add_argument("--level", type=int, action="append", help="level index, may be repeated")
+    parser.add_argument("--ticks", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--enemies", type=int, default=10, help="enemy multiplier for the stress scenarios")
+    parser.add_argument("--bullets", type=int, default=2000, help="live bullets for the stress scenarios")
+    parser.add_argument("--columns", type=int, default=2000, help="map width for the stress scenarios")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    scenarios = [
+        ("base", {}),
+        ("enemies", {"enemies": args.enemies}),
+        ("bullets", {"bullets": args.bullets}),
+        ("columns", {"columns": args.columns}),
+        ("stress", {"enemies": args.enemies, "bullets": args.bullets, "columns": args.columns}),
+    ]
+    report = run_suite(args.level or [0, 1, 2], scenarios, args.ticks, args.seed)
+    if args.baseline:
+        with open(args.baseline) as file:
+            report = compare(report, json.load(file))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import platform
+import random
+import time
+
+from benchmark.scenarios import flood_bullets, load_world
+
+SUBSYSTEMS = ["collision", "player", "map", "bullets", "total"]
+
+
+def timed(function, timings, name):
+    def wrapper(*args):
+        start = time.perf_counter_ns()
+        result = function(*args)
+        timings[name] += time.perf_counter_ns() - start
+        return result
+    return wrapper
+
+
+def run_scenario(level, ticks, enemies=1, bullets=0, columns=None, seed=0):
+    rng = random.Random(seed)
+    world = load_world(level, enemies, columns, seed)
+    player = world.player
+    player.invulnerability_timer = ticks + 1
+    for i in range(len(world.map.enemies.health)):
+        world.map.enemies.health[i] = float("inf")
+
+    timings = dict.fromkeys(SUBSYSTEMS, 0)
+    player.collision = timed(player.collision, timings, "collision")
+    for tick in range(ticks):
+        if bullets > 0:
+            flood_bullets(world, bullets, rng)
+        if tick % 10 == 0:
+            player.shoot()
+
+        start = time.perf_counter_ns()
+        player.update()
+        player_done = time.perf_counter_ns()
+        world.map.update(player.player_sprite.position)
+        map_done = time.perf_counter_ns()
+        world.bullets.update()
+        bullets_done = time.perf_counter_ns()
+
+        timings["player"] += player_done - start
+        timings["map"] += map_done - player_done
+        timings["bullets"] += bullets_done - map_done
+        timings["total"] += bullets_done - start
+
+    return {
+        "level": level,
+        "enemies": len(world.map.enemies.x),
+        "bullets": bullets,
+        "columns": world.map.grid.columns,
+        "ticks": ticks,
+        "us_per_tick": {name: timings[name] / ticks / 1000 for name in SUBSYSTEMS},
+        "ticks_per_second": ticks / (timings["total"] / 1e9) if timings["total"] else 0,
+    }
+
+
+def run_suite(levels, scenarios, ticks, seed=0):
+    results = []
+    for level in levels:
+        for name, scenario in scenarios:
+            result = run_scenario(level, ticks, seed=seed, **scenario)
+            result["scenario"] = name
+            results.append(result)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "ticks": ticks,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare(report, baseline):
+    previous = {(result["level"], result["scenario"]): result for result in baseline["results"]}
+    for result in report["results"]:
+        old = previous.get((result["level"], result["scenario"]))
+        if old is None:
+            continue
+        result["baseline_change_percent"] = {
+            name: (result["us_per_tick"][name] / old["us_per_tick"][name] - 1) * 100
+            for name in SUBSYSTEMS if old["us_per_tick"].get(name)
+        }
+    return report
@@ -0,0 +1,66 @@
+import json
+import os
+import random
+import tempfile
+
+import headless
+import game
+
+WIDE_MAPS_DIRECTORY = os.path.join(tempfile.gettempdir(), "world_of_chaos_benchmark")
+
+
+def widen_map(level, columns):
+    map_file = game.MAPS_DIRECTORY + f"map{level}.json"
+    with open(map_file) as file:
+        data = json.load(file)
+    width = data["width"]
+    if columns is None or columns <= width:
+        return map_file
+
+    for tileset in data["tilesets"]:
+        tileset["source"] = os.path.abspath(os.path.join(game.MAPS_DIRECTORY, tileset["source"]))
+    for layer in data["layers"]:
+        if layer["type"] != "tilelayer":
+            continue
+        tiles = []
+        for row in range(data["height"]):
+            line = layer["data"][row * width:(row + 1) * width]
+            if layer["name"] == "collision":
+                tiles.extend(line[column % width] for column in range(columns))
+            else:
+                tiles.extend(line + [0] * (columns - width))
+        layer["data"] = tiles
+        layer["width"] = columns
+    data["width"] = columns
+
+    os.makedirs(WIDE_MAPS_DIRECTORY, exist_ok=True)
+    wide_file = os.path.join(WIDE_MAPS_DIRECTORY, f"map{level}_{columns}.json")
+    with open(wide_file, "w") as file:
+        json.dump(data, file)
+    return wide_file
+
+
+def multiply_enemies(world, factor, rng):
+    enemies = world.map.enemies
+    for i in range(len(enemies.x)):
+        for _ in range(factor - 1):
+            x = rng.uniform(enemies.patrol_left[i], enemies.patrol_right[i])
+            world.map.add_enemy((x, enemies.y[i] + 3), enemies.type[i])
+
+
+def flood_bullets(world, count, rng):
+    bullets = world.bullets
+    width = world.map.grid.columns * world.map.grid.tile_width
+    height = world.map.grid.rows * world.map.grid.tile_height
+    texture_id = world.player.attack_textures[0]
+    while bullets.count < count:
+        friendly = rng.random() < 0.5
+        bullets.spawn_bullet((rng.uniform(0, width), rng.uniform(0, height)), [rng.choice([-1, 1]), 0],
+                             texture_id, rng.randrange(0, len(game.BULLETS_SPEED)), friendly, 1)
+
+
+def load_world(level, enemies=1, columns=None, seed=0):
+    rng = random.Random(seed)
+    world = headless.new_world(level, widen_map(level, columns), seed)
+    multiply_enemies(world, enemies, rng)
+    return world
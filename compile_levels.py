@@ -0,0 +1,50 @@
+import argparse
+import glob
+import json
+import os
+import time
+
+import pyglet
+
+pyglet.options["shadow_window"] = False
+
+import arcade
+import game
+
+
+def load_time(load, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        load()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def json_load(map_file):
+    if game.textures.headless:
+        game.HeadlessTileMap(map_file, 1)
+    else:
+        arcade.Scene.from_tilemap(arcade.load_tilemap(map_file, 1, lazy=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile Tiled levels into the binary level format")
+    parser.add_argument("maps", nargs="*", help="Tiled JSON maps, all maps/*.json by default")
+    parser.add_argument("--repeat", type=int, default=20, help="loads per parse time measurement")
+    parser.add_argument("--arcade", action="store_true", help="time the arcade sprite path instead of headless")
+    args = parser.parse_args()
+
+    game.textures.headless = not args.arcade
+    for map_file in args.maps or sorted(glob.glob(game.MAPS_DIRECTORY + "*.json")):
+        level_file = game.CompiledTileMap.compile(map_file)
+        print(json.dumps({
+            "map": map_file,
+            "level": level_file,
+            "json_bytes": os.path.getsize(map_file),
+            "level_bytes": os.path.getsize(level_file),
+            "json_ms": load_time(lambda: json_load(map_file), args.repeat),
+            "level_ms": load_time(lambda: game.CompiledTileMap.open(map_file, 1), args.repeat),
+        }))
+
+
+if __name__ == "__main__":
+    main()
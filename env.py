@@ -0,0 +1,158 @@
+import argparse
+import heapq
+import json
+import random
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import headless
+import game
+
+ACTION_LEFT = 1
+ACTION_RIGHT = 2
+ACTION_JUMP = 4
+ACTION_SHOOT = 8
+HELD_ACTIONS = [(ACTION_LEFT, headless.KEYS["LEFT"]), (ACTION_RIGHT, headless.KEYS["RIGHT"]),
+                (ACTION_JUMP, headless.KEYS["UP"])]
+
+OBSERVED_ENEMIES = 4
+OBSERVED_BULLETS = 4
+OBSERVATION_SIZE = 7 + 4 * OBSERVED_ENEMIES + 4 * OBSERVED_BULLETS
+
+REWARD_KILL = 1
+REWARD_WIN = 10
+REWARD_LOSE = -10
+REWARD_DAMAGE = -1 / game.PLAYER_MAX_HEALTH
+
+
+class VectorEnv:
+
+    def __init__(self, count, levels=(0,), seed=0, max_ticks=6000):
+        self.count = count
+        self.levels = list(levels)
+        self.max_ticks = max_ticks
+        self.random = random.Random(seed)
+        self.worlds = [None] * count
+        self.starts = [{} for _ in range(count)]
+        self.held = [0] * count
+        self.alive = [0] * count
+        self.damage = [0] * count
+        self.steps = 0
+        self.seconds = 0
+
+    def reset(self):
+        for i in range(self.count):
+            self.reset_world(i)
+        return self.stack([self.observe(world) for world in self.worlds])
+
+    def reset_world(self, i):
+        level = self.random.choice(self.levels)
+        world = headless.start_world(level, self.random.randrange(2 ** 32), self.starts[i])
+        self.worlds[i] = world
+        self.held[i] = 0
+        self.alive[i] = world.map.enemies.alive_count
+        self.damage[i] = 0
+
+    def step(self, actions):
+        start = time.perf_counter()
+        observations = []
+        rewards = []
+        dones = []
+        for i, (world, action) in enumerate(zip(self.worlds, actions)):
+            world.apply(self.events(i, int(action)))
+            world.tick()
+            player = world.player
+            enemies = world.map.enemies
+            reward = REWARD_KILL * (self.alive[i] - enemies.alive_count) \
+                + REWARD_DAMAGE * (player.damage_taken - self.damage[i])
+            self.alive[i] = enemies.alive_count
+            self.damage[i] = player.damage_taken
+            done = not world.running() or world.ticks >= self.max_ticks
+            if player.game_win:
+                reward += REWARD_WIN
+            elif player.game_lose:
+                reward += REWARD_LOSE
+            rewards.append(reward)
+            dones.append(done)
+            if done:
+                self.reset_world(i)
+            observations.append(self.observe(self.worlds[i]))
+        self.steps += self.count
+        self.seconds += time.perf_counter() - start
+        return self.stack(observations), self.stack(rewards), self.stack(dones)
+
+    def events(self, i, action):
+        # как в Game.on_key_press: удерживаемые клавиши нажимаются и отпускаются по фронтам, выстрел - каждым нажатием
+        events = []
+        for flag, key in HELD_ACTIONS:
+            if action & flag and not self.held[i] & flag:
+                events.append(("press", key))
+            elif self.held[i] & flag and not action & flag:
+                events.append(("release", key))
+        if action & ACTION_SHOOT:
+            events.append(("press", headless.KEYS["SPACE"]))
+        self.held[i] = action & (ACTION_LEFT | ACTION_RIGHT | ACTION_JUMP)
+        return events
+
+    def observe(self, world):
+        player = world.player
+        x, y = player.player_sprite.position
+        observation = [x, y, player.health, player.on_ground, player.direction,
+                       player.invulnerability_timer, player.big_bullets_timer]
+
+        enemies = world.map.enemies
+        nearest = heapq.nsmallest(OBSERVED_ENEMIES, enemies.alive,
+                                  key=lambda i: (enemies.x[i] - x) ** 2 + (enemies.y[i] - y) ** 2)
+        for i in nearest:
+            observation += [enemies.x[i] - x, enemies.y[i] - y, enemies.health[i], enemies.type[i]]
+        observation += [0] * (4 * (OBSERVED_ENEMIES - len(nearest)))
+
+        bullets = world.bullets
+        hostile = [i for i in range(bullets.count) if not bullets.friendly[i]]
+        nearest = heapq.nsmallest(OBSERVED_BULLETS, hostile,
+                                  key=lambda i: (bullets.x[i] - x) ** 2 + (bullets.y[i] - y) ** 2)
+        for i in nearest:
+            observation += [bullets.x[i] - x, bullets.y[i] - y, bullets.velocity_x[i], bullets.damage[i]]
+        observation += [0] * (4 * (OBSERVED_BULLETS - len(nearest)))
+        return observation
+
+    def stack(self, rows):
+        if numpy is None:
+            return rows
+        return numpy.asarray(rows, dtype=numpy.float32)
+
+    def steps_per_second(self):
+        return self.steps / self.seconds if self.seconds else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step many headless World of Chaos episodes in lock-step")
+    parser.add_argument("--worlds", type=int, default=256)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--level", type=int, action="append", help="level index, may be repeated")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    env = VectorEnv(args.worlds, args.level or [0, 1, 2], args.seed)
+    actions = random.Random(args.seed)
+    env.reset()
+    episodes = 0
+    for _ in range(args.steps):
+        _, _, dones = env.step([actions.randrange(16) for _ in range(args.worlds)])
+        episodes += sum(bool(done) for done in dones)
+    print(json.dumps({
+        "worlds": args.worlds,
+        "steps": env.steps,
+        "episodes": episodes,
+        "observation_size": OBSERVATION_SIZE,
+        "numpy": numpy is not None,
+        "steps_per_second": env.steps_per_second(),
+    }))
+
+
+if __name__ == "__main__":
+    main()
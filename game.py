@@ -1,5 +1,23 @@
-from random import randrange
+import argparse
+import csv
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+import zlib
+from collections import OrderedDict, deque
+from operator import add
+from random import Random, randrange
+
+# отсчёт запуска начинается до импорта arcade, самой долгой части импорта
+STARTED = time.perf_counter()
 import arcade
+from PIL import Image
 
 SCREEN_TITLE = "World of Chaos"
 SCREEN_WIDTH = 1024
@@ -10,88 +28,524 @@ AUDIO_DIRECTORY = "audio/"
 IMAGES_DIRECTORY = "images/"
 MAPS_DIRECTORY = "maps/"
 
-
+LEVEL_FORMAT = b"WOCL"
+LEVEL_VERSION = 2
+# Биты отражения в номерах тайлов Tiled; бинарный формат отражённые тайлы не поддерживает
+TILE_FLIP_BITS = 0xE0000000
+LEVEL_EXTENSION = ".level"
+
+REPLAY_FORMAT = b"WOCR"
+REPLAY_VERSION = 2
+REPLAY_ACTIONS = ["press", "release"]
+
+# Снимок состояния мира: заголовок с тиком и генератором случайных чисел, затем игрок, враги, пули и бонусы
+SNAPSHOT_FORMAT = b"WOCS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sHI625I?d")
+SNAPSHOT_PLAYER = struct.Struct("<4d3i5i2B8?")
+
+MUSIC = ["game_level_0.mp3", "game_level_1.mp3", "game_level_2.mp3"]
+MUSIC_STREAMING = True
+
+# Заставки, фоны и надписи меню загружаются при первом показе, а не при запуске
+STARTUP_LAZY = True
+SCREEN_IMAGES = ["start_screen.png", "next_level_screen.png", "win_screen.png", "lose_screen.png"]
+BACKGROUND_IMAGES = ["levelbg0.png", "levelbg1.png", "levelbg2.png"]
+LAZY_IMAGES = SCREEN_IMAGES + BACKGROUND_IMAGES
+# Экраны и фоны рисуются по одному на весь экран и в общий атлас не попадают, у каждого свой атлас по размеру
+STANDALONE_IMAGES = SCREEN_IMAGES + BACKGROUND_IMAGES
+# Поля вокруг картинок в атласе, как у общего атласа arcade
+ATLAS_BORDER = 2
+
+# Ресурсы чужих уровней выгружаются, когда ресурсы уровней превышают этот объём в байтах; общие ресурсы
+# в бюджет не входят. Фон уровня весит около 8 МБ, так что в памяти остаются текущий и предыдущий уровни
+RESOURCE_BUDGET = 20 * 2 ** 20
+
+
+# Скорости заданы в пикселях в секунду, таймеры - в секундах; в тики их переводят per_tick() и tick_count()
 PLAYER_MAX_HEALTH = 200
-PLAYER_JUMP_POWER = 13
-PLAYER_GRAVITY = 6
-
-BULLETS_SPEED = [10, 8, 5, 20, 6, 15]
+PLAYER_SPEED = 300
+PLAYER_JUMP_POWER = 780
+PLAYER_JUMP_TIME = 0.5
+PLAYER_GRAVITY = 360
+PLAYER_HIT_INVULNERABILITY_TIME = 1
+PLAYER_INVULNERABILITY_TIME = 5
+PLAYER_BIG_BULLETS_TIME = 6.67
+
+BULLETS_SPEED = [600, 480, 300, 1200, 360, 900]
 BULLETS_DAMAGE = [-10, -5, -25, -5, -30, -50]
-BULLETS_LIFETIME = [50, 50, 75, 100, 125, 150]
+BULLETS_LIFETIME = [0.84, 0.84, 1.25, 1.67, 2.08, 2.5]
+BULLETS_CAPACITY = 10000
+BULLETS_RADIUS = 30
+BROADPHASE_CELL = 128
 
 
 ENEMY_HEALTH = [20, 10, 30, 40, 50, 100]
 ENEMY_SCALE = [1, 0.8, 0.8, 1.5, 1.2, 1]
 ENEMY_RADIOUS = [300, 300, 500, 500, 800, 800]
-ENEMY_RELOAD = [20, 100, 20, 20, 20, 20]
-
-SPRITES_ANIMATIONS_DELAY = 5
+ENEMY_RELOAD = [0.33, 1.67, 0.33, 0.33, 0.33, 0.33]
+ENEMY_SPEED = 120
+# Враги дальше enemy_wake_distance() от игрока по x спят; расстояние больше любого радиуса атаки
+# на ENEMY_WAKE_MARGIN, сколько игрок пройдёт между проверками раз в ENEMY_WAKE_INTERVAL секунд
+ENEMY_WAKE_MARGIN = 256
+ENEMY_WAKE_INTERVAL = 0.25
+ENEMY_DEAD_X = -500
+
+SPRITES_ANIMATIONS_DELAY = 0.08
+
+# Частота тиков задаётся set_tick_rate(); при 60 тиках в секунду все скорости и таймеры выходят целыми
+TICK_RATE = 60
+FRAME_RATE = 60
+MAX_TICKS_PER_FRAME = 5
+
+GRID_LAYERS = ["collision", "damage", "invulnerability", "health"]
+PICKUP_LAYERS = ["damage", "invulnerability", "health"]
+
+# Карты шире MAP_CHUNKED_WIDTH тайлов рисуются кусками по MAP_CHUNK_COLUMNS столбцов
+MAP_CHUNK_COLUMNS = 16
+MAP_CHUNKED_WIDTH = 128
+
+PROFILER_PHASES = ["player", "camera", "map", "bullets", "draw_scene", "draw_enemies", "draw_bullets", "draw_player",
+                   "draw_gui"]
+PROFILER_COUNTS = ["enemies", "bullets", "tiles"]
+PROFILER_WINDOW = 600
+PROFILER_RECORDS = 36000
+PROFILER_REFRESH = 30
+PROFILER_CSV = "profile.csv"
+PROFILER_KEY = arcade.key.F3
+PROFILER_DUMP_KEY = arcade.key.F4
+
+CAMERA_TEXTS = {
+    "start_game": ("Начать игру", -180, -250, arcade.color.AQUA),
+    "restart": ("Рестарт", -130, -250, arcade.color.YELLOW),
+    "exit_game": ("Выход", -100, -350, arcade.color.RED),
+}
 
 def main():
-    game = Game(0)
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument("--level", type=int, default=0)
+    parser.add_argument("--seed", type=int, help="seed of the gameplay random generator")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE, help="simulation ticks per second")
+    parser.add_argument("--record", help="write the input of each run to its own file, NAME-<level>-<run>.EXT")
+    parser.add_argument("--replay", help="play back a recorded run in real time and verify it")
+    parser.add_argument("--eager-startup", action="store_true", help="load every screen and text before the first frame")
+    parser.add_argument("--startup-report", action="store_true", help="print startup timings after the first frame")
+    parser.add_argument("--resource-budget", type=float,
+                        help="per-level texture and sound budget in MB, shared assets excluded")
+    args = parser.parse_args()
+    if args.resource_budget is not None:
+        resources.budget = int(args.resource_budget * 2 ** 20)
+    game = Game(args.level, tick_rate=args.tick_rate, seed=args.seed, record=args.record, replay=args.replay,
+                lazy=not args.eager_startup, startup_report=args.startup_report)
     arcade.run()
+    print(json.dumps(game.report()))
+
+
+def lerp(a, b, t):
+    return (1 - t) * a + t * b
+
+
+def set_tick_rate(rate):
+    global TICK_RATE
+    TICK_RATE = rate
+
+
+def per_tick(speed):
+    # при 60 тиках в секунду скорости целые, поэтому симуляция совпадает с прежней потиковой
+    speed /= TICK_RATE
+    return int(speed) if speed.is_integer() else speed
+
+
+def tick_count(seconds):
+    return max(round(seconds * TICK_RATE), 1)
+
+
+def enemy_wake_distance():
+    # считается по текущей таблице радиусов, чтобы её можно было подменять при подборе баланса
+    return max(ENEMY_RADIOUS) + ENEMY_WAKE_MARGIN
+
+
+def swept_hit(x0, y0, x1, y1, center_x, center_y, radius):
+    # момент входа отрезка (x0, y0) -> (x1, y1) в круг, от 0 до 1, или None
+    from_x = x0 - center_x
+    from_y = y0 - center_y
+    c = from_x * from_x + from_y * from_y - radius * radius
+    if c < 0:
+        return 0
+    dx = x1 - x0
+    dy = y1 - y0
+    a = dx * dx + dy * dy
+    b = from_x * dx + from_y * dy
+    if a == 0 or b >= 0:
+        return None
+    discriminant = b * b - a * c
+    if discriminant <= 0:
+        return None
+    t = (-b - math.sqrt(discriminant)) / a
+    if t < 1:
+        return t
+    return None
 
 
 
 class Game(arcade.Window):
 
-    def __init__(self, level):
-        super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
+    def __init__(self, level, tick_rate=TICK_RATE, frame_rate=FRAME_RATE, seed=None, record=None, replay=None,
+                 lazy=STARTUP_LAZY, startup_report=False):
+        startup.lap("import")
+        super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE,
+                         update_rate=1 / frame_rate, draw_rate=1 / frame_rate)
         arcade.set_background_color(arcade.csscolor.CORNFLOWER_BLUE)
+        startup.lap("window")
+        self.accumulator = 0
+        self.startup_report = startup_report
+        self.loader = LevelLoader()
+        self.record = record
+        self.runs = 0
+        self.replay = None
+        if replay is not None:
+            self.replay = Recording.load(replay)
+            level = self.replay.level
+            seed = self.replay.seed
+            tick_rate = self.replay.tick_rate
+        elif record is not None and seed is None:
+            seed = randrange(0, 2 ** 32)
+        self.seed = seed
+        set_tick_rate(tick_rate)
+        self.tick_time = 1 / tick_rate
+        sheets = textures.tileset_images(MAPS_DIRECTORY)
+        textures.preload(IMAGES_DIRECTORY, sheets + LAZY_IMAGES if lazy else sheets)
+        startup.lap("textures")
+        textures.pack(self.ctx, textures.load_tilesets(MAPS_DIRECTORY), STANDALONE_IMAGES)
+        startup.lap("atlas")
+        self.camera = Camera(lazy)
+        startup.lap("camera")
         self.setup(level)
+        startup.lap("world")
 
-    def setup(self, level):
-        self.map = Map()
-        self.camera = Camera()
-        self.audio = Audio()
-        self.player = Player()
+    def setup(self, level, world=None, audio=None):
         self.map_index = level
-        self.bullets = Bullets(self.player, self.map)
-        self.map.setup(self.map_index, self.bullets, self.player)
-        self.audio.setup()
+        if world is None:
+            audio = Audio()
+            audio.setup(self.map_index)
+            world = World(self.map_index, audio, seed=self.seed)
+        self.audio = audio
+        self.world = world
+        self.finished = False
+        if self.record is not None:
+            self.world.recording = Recording(self.map_index, self.seed)
+        self.map = self.world.map
+        self.player = self.world.player
+        self.bullets = self.world.bullets
         self.audio.play_music(self.map_index)
-        self.player.setup(self.map, self.audio, self.bullets)
         self.camera.setup(self.player, self.map_index)
+        resources.enter(self.map_index)
         self.restarting = False
+        self.checkpoint = self.world.snapshot()
+        if self.replay is not None:
+            self.player.game_started = True
 
 
     def restart(self, with_level):
+        start = time.perf_counter()
+        self.finish_run()
+        prepared = self.loader.take(with_level)
         self.audio.stop_music()
+        self.world = None
         self.map = None
-        self.camera = None
         self.audio = None
         self.player = None
         self.restarting = True
-        self.setup(with_level)
-
-
+        if prepared is None:
+            self.setup(with_level)
+            print(f"Level {with_level} loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+        else:
+            self.setup(with_level, *prepared)
+            print(f"Level {with_level} swapped in {(time.perf_counter() - start) * 1000:.1f} ms "
+                  f"(prefetched in background in {self.loader.load_time * 1000:.1f} ms)")
+        report = resources.report()
+        print(f"Level assets {report['resident_bytes'] / 2 ** 20:.1f} MB of {report['budget'] / 2 ** 20:.1f} MB "
+              f"plus {report['pinned_bytes'] / 2 ** 20:.1f} MB shared, {report['evictions']} evicted so far")
+
+
+
+    def retry(self):
+        # после проигрыша первый уровень откатывается к снимку своего начала, а не перечитывается с диска
+        if self.map_index != 0:
+            self.restart(0)
+            return
+        start = time.perf_counter()
+        self.finish_run()
+        self.world.restore(self.checkpoint)
+        self.camera.reset()
+        self.finished = False
+        if self.record is not None:
+            self.world.recording = Recording(self.map_index, self.seed)
+        self.audio.play_music(self.map_index)
+        print(f"Level {self.map_index} restored from a {len(self.checkpoint)} byte checkpoint "
+              f"in {(time.perf_counter() - start) * 1000:.2f} ms")
 
     def on_update(self, delta_time):
-
-        if self.player.game_started and not self.player.game_win and not self.player.game_lose:
-            self.player.update()
+        self.accumulator += delta_time
+        ticks = 0
+        while self.accumulator >= self.tick_time and ticks < MAX_TICKS_PER_FRAME:
+            self.tick()
+            self.accumulator -= self.tick_time
+            ticks += 1
+        if ticks == MAX_TICKS_PER_FRAME:
+            self.accumulator = min(self.accumulator, self.tick_time)
+
+    def tick(self):
+        if self.replay is not None and not self.finished:
+            self.world.apply(self.replay.events_at(self.world.ticks))
+        if self.world.tick():
             self.camera.update(self.player.player_sprite.position[0] - SCREEN_WIDTH / 2)
-            self.map.update(self.player.player_sprite.position)
-            self.bullets.update()
+            profiler.lap("camera")
+        else:
+            # пока симуляция стоит, кадры рисуются без интерполяции к последнему тику
+            self.world.settle()
+            self.camera.previous_position = self.camera.position
+            # атлас после выгрузки прошлого уровня перестраивается на неподвижном экране, а не при смене уровня
+            textures.compact()
+            if self.player.game_started:
+                self.finish_run()
+        if self.replay is not None and self.world.ticks >= self.replay.ticks:
+            self.finish_run()
+        if self.player.game_win and self.map_index < 2:
+            self.loader.prefetch(self.map_index + 1, self.seed)
+            if self.loader.ready(self.map_index + 1):
+                self.camera.prepare(self.map_index + 1)
+
+    def finish_run(self):
+        if self.finished:
+            return
+        self.finished = True
+        # каждый сыгранный заход пишется в свой файл, пустые записи не сохраняются
+        if self.world.recording is not None and self.world.ticks > 0:
+            self.world.recording.finish(self.world)
+            self.runs += 1
+            name, extension = os.path.splitext(self.record)
+            path = f"{name}-{self.map_index}-{self.runs}{extension}"
+            self.world.recording.save(path)
+            print(f"Run of {self.world.ticks} ticks recorded to {path}")
+        if self.replay is not None:
+            result = "matches" if self.world.checksum() == self.replay.checksum else "DOES NOT match"
+            print(f"Replay of {self.world.ticks} ticks {result} the recorded state")
+            self.replay = None
+
+    def close(self):
+        self.finish_run()
+        super().close()
 
 
     def on_draw(self):
+        alpha = min(self.accumulator / self.tick_time, 1)
         self.clear()
+        profiler.mark()
         self.camera.bg_camera.use()
         self.camera.draw_bg()
+        self.camera.interpolate(alpha)
         self.camera.main_camera.use()
-        self.map.scene.draw()
-        self.map.draw()
-        self.bullets.draw()
-        self.player.draw()
+        left = self.camera.main_camera.position[0]
+        self.map.draw_tiles(left, left + SCREEN_WIDTH)
+        profiler.lap("draw_scene")
+        self.map.draw(alpha)
+        profiler.lap("draw_enemies")
+        self.bullets.draw(alpha)
+        profiler.lap("draw_bullets")
+        self.player.draw(alpha)
+        profiler.lap("draw_player")
         self.camera.gui_camera.use()
         self.camera.draw_gui()
+        profiler.lap("draw_gui")
+        if profiler.enabled:
+            profiler.end_frame(self.entity_counts())
+            profiler.draw()
+        if startup.first_frame is None:
+            startup.finish()
+            if self.startup_report:
+                print(json.dumps(startup.report(), indent=1))
+
+    def report(self):
+        report = {"textures": textures.report(), "sounds": sounds.report()}
+        if self.map.chunks is not None:
+            report["chunks"] = self.map.chunks.report()
+        return report
+
+    def entity_counts(self):
+        if self.map.chunks is None:
+            tiles = sum(len(sprite_list) for sprite_list in self.map.tile_map.sprite_lists.values())
+        else:
+            tiles = sum(len(sprite_list) for sprite_list in self.map.chunks.visible)
+        return {"enemies": self.map.enemies.alive_count, "bullets": self.bullets.count, "tiles": tiles}
 
 
     def on_key_press(self, key, modifiers):
-        if self.map_index > 0 and not self.player.game_started:
+        if key == PROFILER_KEY:
+            profiler.enabled = not profiler.enabled
+        elif key == PROFILER_DUMP_KEY:
+            print(f"Profile of {len(profiler.records)} frames written to {profiler.dump()}")
+        elif self.replay is not None:
+            return
+        elif self.map_index > 0 and not self.player.game_started:
             self.player.game_started = True
-        elif not self.restarting and not self.player.game_lose and not self.player.game_win:
+        elif not self.restarting:
+            self.world.press(key)
+
+
+    def on_key_release(self, key, modifiers):
+        if not self.restarting and self.replay is None:
+            self.world.release(key)
+
+
+    def on_mouse_press(self, x, y, button, modifiers):
+        if not self.player.game_started and self.map_index == 0:
+            if self.text_has_collision(x, y, self.camera.text("start_game")):
+                self.player.game_started = True
+            elif self.text_has_collision(x, y, self.camera.text("exit_game")):
+                self.close()
+        elif self.player.game_lose:
+            if self.text_has_collision(x, y, self.camera.text("restart")):
+                self.retry()
+            elif self.text_has_collision(x, y, self.camera.text("exit_game")):
+                self.close()
+        elif self.player.game_win:
+            if self.map_index >= 2:
+                self.close()
+            else:
+                self.restart(self.map_index + 1)
+    def text_has_collision(self, x, y, text):
+        return (text.position[0] < x < (text.position[0] + text.content_width)
+                and text.position[1] < y < (text.position[1] + text.content_height))
+
+
+class LevelLoader:
+
+    def __init__(self):
+        self.level = None
+        self.thread = None
+        self.world = None
+        self.audio = None
+        self.load_time = 0
+
+    def prefetch(self, level, seed=None):
+        if self.level == level:
+            return
+        self.level = level
+        self.world = None
+        self.audio = None
+        self.thread = threading.Thread(target=self.load, args=(level, seed), daemon=True)
+        self.thread.start()
+
+    def load(self, level, seed=None):
+        start = time.perf_counter()
+        audio = Audio()
+        audio.setup(level)
+        world = World(level, audio, seed=seed)
+        # фон декодируется здесь же, а на видеокарту попадает в основном потоке после конца загрузки
+        textures.id(BACKGROUND_IMAGES[level], level)
+        self.load_time = time.perf_counter() - start
+        self.world, self.audio = world, audio
+
+    def ready(self, level):
+        return self.level == level and not self.thread.is_alive()
+
+    def take(self, level):
+        if self.level != level:
+            return None
+        self.thread.join()
+        prepared = None
+        if self.world is not None:
+            prepared = self.world, self.audio
+        self.level = None
+        self.thread = None
+        self.world = None
+        self.audio = None
+        return prepared
+
+
+class World:
+
+    def __init__(self, level, audio=None, map_file=None, seed=None):
+        self.level = level
+        self.random = Random(seed)
+        self.ticks = 0
+        self.recording = None
+        self.map = Map()
+        self.player = Player(self.random)
+        self.bullets = Bullets(self.player, self.map)
+        self.map.setup(level, self.bullets, self.player, map_file)
+        self.player.setup(self.map, audio, self.bullets)
+
+    def running(self):
+        return self.player.game_started and not self.player.game_win and not self.player.game_lose
+
+    def tick(self):
+        if not self.running():
+            return False
+        self.ticks += 1
+        profiler.mark()
+        self.player.update()
+        profiler.lap("player")
+        self.map.update(self.player.player_sprite.position)
+        profiler.lap("map")
+        self.bullets.update()
+        profiler.lap("bullets")
+        return True
+
+    def settle(self):
+        self.player.previous_position = self.player.player_sprite.position
+        enemies = self.map.enemies
+        enemies.previous_x[:] = enemies.x
+        live = slice(0, self.bullets.count)
+        self.bullets.previous_x[live] = self.bullets.x[live]
+        self.bullets.previous_y[live] = self.bullets.y[live]
+
+    def apply(self, events):
+        for action, key in events:
+            if action == "press":
+                self.press(key)
+            else:
+                self.release(key)
+
+    def snapshot(self):
+        _, state, gauss = self.random.getstate()
+        return SNAPSHOT_HEADER.pack(SNAPSHOT_FORMAT, SNAPSHOT_VERSION, self.ticks,
+                                    *state, gauss is not None, gauss or 0) + self.state()
+
+    def state(self):
+        # видимая часть снимка, без тика и генератора случайных чисел
+        buffer = bytearray()
+        self.player.snapshot(buffer)
+        self.map.enemies.snapshot(buffer)
+        self.bullets.snapshot(buffer)
+        self.map.pickups.snapshot(buffer)
+        return bytes(buffer)
+
+    def restore(self, snapshot):
+        magic, version, self.ticks, *state, has_gauss, gauss = SNAPSHOT_HEADER.unpack_from(snapshot)
+        if magic != SNAPSHOT_FORMAT or version != SNAPSHOT_VERSION:
+            raise ValueError(f"not a version {SNAPSHOT_VERSION} world snapshot")
+        self.random.setstate((Random.VERSION, tuple(state), gauss if has_gauss else None))
+        offset = self.player.restore(snapshot, SNAPSHOT_HEADER.size)
+        offset = self.map.enemies.restore(snapshot, offset)
+        offset = self.bullets.restore(snapshot, offset)
+        self.map.pickups.restore(snapshot, offset)
+
+    def checksum(self):
+        player = self.player
+        enemies = self.map.enemies
+        count = self.bullets.count
+        state = (self.ticks, player.player_sprite.position, player.health, player.invulnerability_timer,
+                 player.big_bullets_timer, player.game_win, player.game_lose,
+                 enemies.x, enemies.health, enemies.dead, enemies.reload,
+                 self.bullets.x[:count], self.bullets.y[:count], self.bullets.lifetime[:count])
+        return hashlib.md5(repr(state).encode()).digest()
+
+    def press(self, key):
+        if self.recording is not None:
+            self.recording.record(self.ticks, "press", key)
+        if not self.player.game_lose and not self.player.game_win:
             if key == arcade.key.UP or key == arcade.key.W:
                 self.player.jump()
             if key == arcade.key.SPACE:
@@ -101,9 +555,10 @@ class Game(arcade.Window):
             elif key == arcade.key.LEFT or key == arcade.key.A:
                 self.player.key_pressed_left = True
 
-
-    def on_key_release(self, key, modifiers):
-        if not self.restarting and not self.player.game_lose and not self.player.game_win:
+    def release(self, key):
+        if self.recording is not None:
+            self.recording.record(self.ticks, "release", key)
+        if not self.player.game_lose and not self.player.game_win:
             if key == arcade.key.UP or key == arcade.key.W:
                 self.player.jumping = False
             if key == arcade.key.RIGHT or key == arcade.key.D:
@@ -112,44 +567,78 @@ class Game(arcade.Window):
                 self.player.key_pressed_left = False
 
 
-    def on_mouse_press(self, x, y, button, modifiers):
-        if not self.player.game_started and self.map_index == 0:
-            if self.text_has_collision(x, y, self.camera.start_game):
-                self.player.game_started = True
-            elif self.text_has_collision(x, y, self.camera.exit_game):
-                super().close()
-        elif self.player.game_lose:
-            if self.text_has_collision(x, y, self.camera.restart):
-                self.restart(0)
-            elif self.text_has_collision(x, y, self.camera.exit_game):
-                super().close()
-        elif self.player.game_win:
-            if self.map_index >= 2:
-                super().close()
-            else:
-                self.restart(self.map_index + 1)
-    def text_has_collision(self, x, y, text):
-        return (text.position[0] < x < (text.position[0] + text.content_width)
-                and text.position[1] < y < (text.position[1] + text.content_height))
+class Recording:
+
+    def __init__(self, level=0, seed=0, tick_rate=None):
+        self.level = level
+        self.seed = seed
+        self.tick_rate = tick_rate or TICK_RATE
+        self.events = []
+        self.ticks = 0
+        self.checksum = bytes(16)
+        self.by_tick = None
+
+    def record(self, tick, action, key):
+        self.events.append((tick, action, key))
+
+    def finish(self, world):
+        self.ticks = world.ticks
+        self.checksum = world.checksum()
+
+    def events_at(self, tick):
+        if self.by_tick is None:
+            self.by_tick = {}
+            for event_tick, action, key in self.events:
+                self.by_tick.setdefault(event_tick, []).append((action, key))
+        return self.by_tick.get(tick, [])
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(struct.pack("<4sHBQHI16sI", REPLAY_FORMAT, REPLAY_VERSION, self.level, self.seed,
+                                   self.tick_rate, self.ticks, self.checksum, len(self.events)))
+            for tick, action, key in self.events:
+                file.write(struct.pack("<IBI", tick, REPLAY_ACTIONS.index(action), key))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        header = struct.Struct("<4sHBQHI16sI")
+        magic, version, level, seed, tick_rate, ticks, checksum, count = header.unpack_from(data)
+        if magic != REPLAY_FORMAT or version != REPLAY_VERSION:
+            raise ValueError(f"{path} is not a version {REPLAY_VERSION} recording")
+        recording = cls(level, seed, tick_rate)
+        recording.ticks = ticks
+        recording.checksum = checksum
+        recording.events = [(tick, REPLAY_ACTIONS[action], key)
+                            for tick, action, key in struct.iter_unpack("<IBI", data[header.size:header.size + count * 9])]
+        return recording
 
 
 class Player:
 
-    def __init__(self):
-        self.sprite_list = arcade.SpriteList()
-        self.tex_right = arcade.load_texture(IMAGES_DIRECTORY + "player.png")
-        self.tex_left = self.tex_right.flip_horizontally()
-        self.player_sprite = arcade.Sprite(self.tex_right, 1)
+    def __init__(self, _random=None):
+        self.random = _random or Random()
+        self.sprite_list = new_sprite_list()
+        texture_id = textures.id("player.png")
+        self.tex_right = textures.get(texture_id)
+        self.tex_left = textures.get(texture_id, True)
+        self.player_sprite = new_sprite(self.tex_right, 1)
         self.sprite_list.append(self.player_sprite)
 
-        self.tex_fly_right = arcade.load_texture(IMAGES_DIRECTORY + "player_jump.png")
-        self.tex_fly_left = self.tex_fly_right.flip_horizontally()
+        texture_id = textures.id("player_jump.png")
+        self.tex_fly_right = textures.get(texture_id)
+        self.tex_fly_left = textures.get(texture_id, True)
         self.current_walk_sprite_id = 0
         self.tex_walk_right = []
         self.tex_walk_left = []
         for i in range(0, 3):
-            self.tex_walk_right.append(arcade.load_texture(IMAGES_DIRECTORY + "player_walk_" + str(i) + ".png"))
-            self.tex_walk_left.append(self.tex_walk_right[i].flip_horizontally())
+            texture_id = textures.id("player_walk_" + str(i) + ".png")
+            self.tex_walk_right.append(textures.get(texture_id))
+            self.tex_walk_left.append(textures.get(texture_id, True))
+        self.attack_textures = [textures.id("player_attack_0.png"), textures.id("player_attack_1.png")]
+        self.animation = [self.tex_right, self.tex_left, self.tex_fly_right, self.tex_fly_left] \
+            + self.tex_walk_right + self.tex_walk_left
 
         self.map = None
         self.audio = None
@@ -166,12 +655,14 @@ class Player:
         self.big_bullets_timer = 0
 
         self.health = PLAYER_MAX_HEALTH
+        self.damage_taken = 0
 
         self.game_started = False
         self.game_win = False
         self.game_lose = False
 
         self.sprite_change = 0
+        self.previous_position = self.player_sprite.position
 
     def setup(self, _map, _audio, _bullets):
         self.map = _map
@@ -181,12 +672,21 @@ class Player:
 
         self.map.spawn_player(self.player_sprite)
         self.player_sprite.center_y += self.player_sprite.height / 2
+        self.previous_position = self.player_sprite.position
+        self.map.pickups.callbacks = {"damage": self.pick_big_bullets,
+                                      "invulnerability": self.pick_invulnerability,
+                                      "health": self.pick_health}
 
 
-    def draw(self):
+    def draw(self, alpha=1):
+        position = self.player_sprite.position
+        self.player_sprite.position = (lerp(self.previous_position[0], position[0], alpha),
+                                       lerp(self.previous_position[1], position[1], alpha))
         self.sprite_list.draw()
+        self.player_sprite.position = position
 
     def update(self):
+        self.previous_position = self.player_sprite.position
 
         if self.invulnerability_timer > 0:
             self.invulnerability_timer -= 1
@@ -199,10 +699,10 @@ class Player:
 
 
         if self.key_pressed_right:
-            self.speed = 5
+            self.speed = per_tick(PLAYER_SPEED)
             self.direction = True
         elif self.key_pressed_left:
-            self.speed = -5
+            self.speed = -per_tick(PLAYER_SPEED)
             self.direction = False
         else:
             self.speed = 0
@@ -213,13 +713,13 @@ class Player:
 
         if self.jumping:
             self.jump_timer -= 1
-            self.player_sprite.center_y += PLAYER_JUMP_POWER
+            self.player_sprite.center_y += per_tick(PLAYER_JUMP_POWER)
             if self.jump_timer <= 0:
                 self.jumping = False
 
 
         if not self.on_ground:
-            self.player_sprite.center_y -= PLAYER_GRAVITY
+            self.player_sprite.center_y -= per_tick(PLAYER_GRAVITY)
 
 
         self.collision()
@@ -228,62 +728,93 @@ class Player:
     def jump(self):
         if self.on_ground:
             self.jumping = True
-            self.jump_timer = 30
+            self.jump_timer = tick_count(PLAYER_JUMP_TIME)
 
     def collision(self):
 
         if self.player_sprite.top < 0:
             self.add_health(-PLAYER_MAX_HEALTH)
-        collisions = ["collision", "damage", "invulnerability", "health"]
-        for i in range(0, 4):
-            if self.map.scene[collisions[i]].__len__() > 0:
-                distances = []
-                for block in self.map.scene[collisions[i]]:
-                    distances.append((pow((block.center_x - self.player_sprite.center_x), 2) + pow(
-                        (block.center_y - self.player_sprite.center_y), 2)) ** 0.5)
-                block_index = distances.index(min(distances))
-                block = self.map.scene[collisions[i]][block_index]
-
-                if collisions[i] == 'collision':  
-                    if (self.player_sprite.right > block.left and self.player_sprite.left < block.right) \
-                            and (self.player_sprite.top > block.bottom and self.player_sprite.bottom < block.top):
-                        self.on_ground = True  
-                        if self.player_sprite.bottom < block.top - 15:
-                            self.player_sprite.center_x -= 10  
-                            self.player_sprite.center_y -= 10
-                    else:  
-                        self.on_ground = False 
-                elif collisions[i] == 'damage':
-                    if (self.player_sprite.right > block.left and self.player_sprite.left < block.right) \
-                            and (self.player_sprite.top > block.bottom and self.player_sprite.bottom < block.top): 
-                        self.map.scene['damage'][block_index].remove_from_sprite_lists()  
-                        self.big_bullets_timer = 400
-                elif collisions[i] == 'invulnerability':
-                    if (self.player_sprite.right > block.left and self.player_sprite.left < block.right) \
-                            and (self.player_sprite.top > block.bottom and self.player_sprite.bottom < block.top): 
-                        self.map.scene['invulnerability'][block_index].remove_from_sprite_lists() 
-                        self.invulnerability_timer = 300 
-                        self.player_sprite.alpha = 100
-                elif collisions[i] == 'health':
-                    if (self.player_sprite.right > block.left and self.player_sprite.left < block.right) \
-                            and (
-                            self.player_sprite.top > block.bottom and self.player_sprite.bottom < block.top):
-                        self.map.scene['health'][
-                            block_index].remove_from_sprite_lists()  
-                        self.add_health(50)  
+
+        self.on_ground = False
+        for block in self.touching("collision"):
+            if self.player_sprite.bottom >= block.top - 15:
+                self.on_ground = True
+            else:
+                self.push_out(block)
+
+        self.map.pickups.update(self.player_sprite)
 
         
-        for i in range(0, self.map.enemys.__len__()):  
-            if not self.map.enemys[i].dead:
-                enemy_sprite = self.map.enemys[i].sprite  
+        # до спящих врагов игрок не дотягивается, поэтому проверяются только активные
+        enemies = self.map.enemies
+        for i in enemies.active[:]:
+            if not enemies.dead[i]:
+                enemy_sprite = enemies.sprites[i]
 
                 if (self.player_sprite.right > enemy_sprite.left and self.player_sprite.left < enemy_sprite.right) \
                         and (
                         self.player_sprite.top > enemy_sprite.bottom and self.player_sprite.bottom < enemy_sprite.top):
                     if self.player_sprite.bottom + 10 >= enemy_sprite.top and self.invulnerability_timer <= 0:
-                        self.map.enemys[i].kill_enemy()
+                        enemies.kill(i)
                     else:
                         self.damage_player(-10)
+
+    def touching(self, layer):
+        sprite = self.player_sprite
+        blocks = []
+        for block in self.map.grid.query(layer, sprite.left, sprite.bottom, sprite.right, sprite.top):
+            if (sprite.right > block.left and sprite.left < block.right) \
+                    and (sprite.top > block.bottom and sprite.bottom < block.top):
+                blocks.append(block)
+        return blocks
+
+    def snapshot(self, buffer):
+        sprite = self.player_sprite
+        texture = next(i for i, texture in enumerate(self.animation) if texture is sprite.texture)
+        buffer += SNAPSHOT_PLAYER.pack(
+            sprite.center_x, sprite.center_y, self.previous_position[0], self.previous_position[1],
+            self.speed, self.health, self.damage_taken,
+            self.jump_timer, self.invulnerability_timer, self.big_bullets_timer, self.sprite_change,
+            self.current_walk_sprite_id, sprite.alpha, texture,
+            self.direction, self.key_pressed_left, self.key_pressed_right, self.jumping, self.on_ground,
+            self.game_started, self.game_win, self.game_lose)
+
+    def restore(self, snapshot, offset):
+        sprite = self.player_sprite
+        (x, y, previous_x, previous_y, self.speed, self.health, self.damage_taken,
+         self.jump_timer, self.invulnerability_timer, self.big_bullets_timer, self.sprite_change,
+         self.current_walk_sprite_id, alpha, texture,
+         self.direction, self.key_pressed_left, self.key_pressed_right, self.jumping, self.on_ground,
+         self.game_started, self.game_win, self.game_lose) = SNAPSHOT_PLAYER.unpack_from(snapshot, offset)
+        sprite.texture = self.animation[texture]
+        sprite.position = x, y
+        sprite.alpha = alpha
+        self.previous_position = previous_x, previous_y
+        return offset + SNAPSHOT_PLAYER.size
+
+    def pick_big_bullets(self):
+        self.big_bullets_timer = tick_count(PLAYER_BIG_BULLETS_TIME)
+
+    def pick_invulnerability(self):
+        self.invulnerability_timer = tick_count(PLAYER_INVULNERABILITY_TIME)
+        self.player_sprite.alpha = 100
+
+    def pick_health(self):
+        self.add_health(50)
+
+    def push_out(self, block):
+        sprite = self.player_sprite
+        push_left = sprite.right - block.left
+        push_right = block.right - sprite.left
+        push_down = sprite.top - block.bottom
+        if push_down < push_left and push_down < push_right:
+            sprite.center_y -= push_down
+            self.jumping = False
+        elif push_left < push_right:
+            sprite.center_x -= push_left
+        else:
+            sprite.center_x += push_right
+
     def add_health(self, health):
         self.health = min(self.health + health, PLAYER_MAX_HEALTH)
         if self.health <= 0:
@@ -292,8 +823,9 @@ class Player:
 
     def damage_player(self, damage):
         if self.invulnerability_timer <= 0:
-            self.invulnerability_timer = 60
+            self.invulnerability_timer = tick_count(PLAYER_HIT_INVULNERABILITY_TIME)
             self.player_sprite.alpha = 100
+            self.damage_taken -= damage
             self.add_health(damage)
 
     
@@ -303,14 +835,14 @@ class Player:
             isRight *= -1
         direction = [self.player_sprite.center_x - self.player_sprite.center_x + isRight, 0]
         sprite_index = 0
-        if randrange(0, 2) == 1:
+        if self.random.randrange(0, 2) == 1:
             sprite_index = 1
 
         scale = 1
         if self.big_bullets_timer > 0:
             scale = 3
         self.bullets.spawn_bullet(self.player_sprite.position, direction,
-                                  IMAGES_DIRECTORY + "player_attack_" + str(sprite_index) + ".png", 0, True, scale)
+                                  self.attack_textures[sprite_index], 0, True, scale)
     def animate_player(self):
         if not self.on_ground:
             if self.direction:
@@ -324,7 +856,7 @@ class Player:
                 self.player_sprite.texture = self.tex_left
         else:  
             if self.sprite_change <= 0:  
-                self.sprite_change = SPRITES_ANIMATIONS_DELAY
+                self.sprite_change = tick_count(SPRITES_ANIMATIONS_DELAY)
                 self.current_walk_sprite_id += 1
                 if self.current_walk_sprite_id > 2:  
                     self.current_walk_sprite_id = 0  
@@ -341,316 +873,1576 @@ class Map:
     def __init__(self):
         self.tile_map = None
         self.scene = None
-        self.enemys = []
+        self.grid = None
+        self.chunks = None
+        self.tiles = None
+        self.pickups = None
+        self.enemies = None
         self.game = 0
         self.level = 0
-        self.enemySpriteList = arcade.SpriteList()
+        self.enemySpriteList = new_sprite_list()
+        self.spawns = []
+        self.load_time = 0
 
-    def setup(self, index, _bullets, player):
+    def setup(self, index, _bullets, player, map_file=None):
         self.level = index
         self.bullets = _bullets
         self.player = player
-        map_file = MAPS_DIRECTORY + f"map{index}.json"
-        self.tile_map = arcade.load_tilemap(map_file, 1)
-        self.scene = arcade.Scene.from_tilemap(self.tile_map)
-
-        for i in range(0, 6):
-          
-            enemystr = "enemy" + str(i)
-            if self.scene.__contains__(enemystr):
-                while self.scene[enemystr].__len__() > 0:
-                    enemy = self.Enemy(self.scene[enemystr][0], i, self, self.bullets) 
-                    self.enemys.append(enemy)  
-                    self.enemySpriteList.append(enemy.sprite)
-                    self.scene[enemystr].pop(0) 
+        if map_file is None:
+            map_file = MAPS_DIRECTORY + f"map{index}.json"
+        start = time.perf_counter()
+        self.tile_map = CompiledTileMap.open(map_file, 1)
+        if self.tile_map is not None:
+            self.scene = self.tile_map.scene()
+        elif textures.headless:
+            self.tile_map = HeadlessTileMap(map_file, 1)
+            self.scene = self.tile_map.sprite_lists
+        else:
+            self.tile_map = arcade.load_tilemap(map_file, 1, lazy=True)
+            self.scene = arcade.Scene.from_tilemap(self.tile_map)
+        self.load_time = time.perf_counter() - start
+        startup.asset(os.path.basename(map_file), self.load_time)
+        self.enemies = Enemies(self, self.bullets)
+
+        self.grid = CollisionGrid(self.tile_map.width, self.tile_map.height,
+                                  self.tile_map.tile_width * self.tile_map.scaling,
+                                  self.tile_map.tile_height * self.tile_map.scaling)
+        for layer in GRID_LAYERS:
+            if self.scene.__contains__(layer):
+                self.grid.add_layer(layer, self.scene[layer])
+            else:
+                self.grid.add_layer(layer, [])
+        self.pickups = Pickups(self.grid)
+
+        if isinstance(self.tile_map, CompiledTileMap):
+            self.spawns = list(self.tile_map.spawns)
+            for _type, x, y, left, right in self.tile_map.enemies:
+                self.add_enemy((x, y), _type, (left, right))
+        else:
+            if self.scene.__contains__("spawn"):
+                while self.scene["spawn"].__len__() > 0:
+                    self.spawns.append(self.scene["spawn"].pop(0).position)
+            for i in range(0, 6):
+
+                enemystr = "enemy" + str(i)
+                if self.scene.__contains__(enemystr):
+                    while self.scene[enemystr].__len__() > 0:
+                        self.add_enemy(self.scene[enemystr][0].position, i)
+                        self.scene[enemystr].pop(0)
+
+        if self.tile_map.width > MAP_CHUNKED_WIDTH:
+            self.chunks = MapChunks(self.tile_map.sprite_lists, MAP_CHUNK_COLUMNS * self.grid.tile_width)
+
+    def add_enemy(self, position, _type, patrol_span=None):
+        enemy = self.Enemy(position, _type, self, patrol_span)
+        self.enemySpriteList.append(enemy.sprite)
+        return enemy
+
+    def patrol_span(self, position):
+        column, row = self.grid.cell(position[0], position[1])
+        while row >= 0 and self.grid.at("collision", column, row) is None:
+            row -= 1
+        if row < 0:
+            return position[0], position[0]
+        left = column
+        while self.grid.at("collision", left - 1, row) is not None:
+            left -= 1
+        right = column
+        while self.grid.at("collision", right + 1, row) is not None:
+            right += 1
+        return left * self.grid.tile_width, (right + 1) * self.grid.tile_width
 
     def spawn_player(self, player_sprite):
-        player_sprite.position = self.scene["spawn"][0].position
-        self.scene["spawn"].pop(0)
+        player_sprite.position = self.spawns.pop(0)
+
+    def draw_tiles(self, left, right):
+        if self.chunks is None:
+            if self.tiles is None:
+                self.tiles = new_sprite_list()
+                for sprite_list in self.tile_map.sprite_lists.values():
+                    for sprite in sprite_list:
+                        self.tiles.append(sprite)
+            self.tiles.draw()
+        else:
+            self.chunks.update(left, right)
+            self.chunks.draw()
 
-    def draw(self):
+    def draw(self, alpha=1):
+        self.enemies.interpolate(alpha)
         self.enemySpriteList.draw()
-        for enemy in self.enemys:
-            enemy.draw()
+        self.enemies.draw()
+        self.enemies.interpolate(1)
 
     def update(self, player_pos):  
-        for enemy in self.enemys:
-            enemy.update(player_pos)
+        self.enemies.update(player_pos)
 
     def check_for_level_complete(self):
-        all_enemy_dead = True
-        for enemy in self.enemys:
-            if not enemy.dead:
-                all_enemy_dead = False
-        if all_enemy_dead:
+        if self.enemies.alive_count == 0:
             self.player.game_win = True
 
 
 
 
     class Enemy:  
-        def __init__(self, sprite, _type, _map, _bullets):
-            self.direction = True
-            self.speed = 2
-            self.dead = False
+        def __init__(self, position, _type, _map, patrol_span=None):
             #  Тип врага
             self.enemyType = _type
-            self.reload = 0
-            self.health = ENEMY_HEALTH[_type]
-            self.tex_right = arcade.load_texture(IMAGES_DIRECTORY + "enemy" + str(int(self.enemyType)) + ".png")
-            self.tex_left = self.tex_right.flip_horizontally()
 
-            self.sprite = arcade.Sprite(self.tex_right, ENEMY_SCALE[_type])
-            self.sprite.position = sprite.position 
+            self.sprite = new_sprite(textures.get(textures.id("enemy" + str(_type) + ".png", _map.level)),
+                                     ENEMY_SCALE[_type])
+            self.sprite.position = position
             self.sprite.center_y -= 3 
-            self.map = _map
-            self.bullets = _bullets
-
-        def update(self, player_pos):
-            if not self.dead:  
-                distance = (pow((self.sprite.position[0] - player_pos[0]), 2) + pow(
-                    (self.sprite.position[1] - player_pos[1]), 2)) ** 0.5
-                if distance < ENEMY_RADIOUS[self.enemyType] and abs(self.sprite.center_y - player_pos[1]) < 100:
-                    self.shoot(player_pos)
-                else:
-                    if self.direction:
-                        self.sprite.center_x += self.speed
-                    else:
-                        self.sprite.center_x -= self.speed
-                    self.collision()
-
-        def draw(self):
-            if not self.dead:
-                health_offset = [self.sprite.center_x - 64, self.sprite.center_y + 64]
-                size = [128, 15]
-                arcade.draw_xywh_rectangle_filled(health_offset[0], health_offset[1], size[0], size[1],
-                                                  arcade.csscolor.BLACK)
-                arcade.draw_xywh_rectangle_filled(health_offset[0] + 4, health_offset[1] + 4,
-                                                  (size[0] - 8) * self.health / ENEMY_HEALTH[self.enemyType],
-                                                  size[1] - 8, arcade.csscolor.RED)
-
-        def shoot(self, player_pos):  
-            if self.reload == 0:
-                if ((self.sprite.position[0] > player_pos[0] and self.direction) or
-                        (self.sprite.position[0] < player_pos[0] and not self.direction)):
-                    self.switch_direction()
-                direction = [1, 0]
-                if player_pos[0] < self.sprite.position[0]:
-                    direction = [-1, 0]
-                self.reload = ENEMY_RELOAD[self.enemyType]
-                self.bullets.spawn_bullet(self.sprite.position, direction, IMAGES_DIRECTORY + "enemy" +
-                                          str(self.enemyType) + "_attack.png", self.enemyType, False, 1)
-            else:
-                self.reload -= 1
+            if patrol_span is None:
+                patrol_span = _map.patrol_span(position)
+            # дальше враг живёт только в таблицах Enemies
+            self.index = _map.enemies.add(self.sprite, _type, patrol_span)
+
+
+class MapChunks:
+
+    def __init__(self, layers, chunk_width):
+        self.chunk_width = chunk_width
+        self.sprites = {}
+        # все слои куска лежат в одном списке по порядку слоёв, чтобы рисовать кусок одним вызовом
+        for sprites in layers.values():
+            for sprite in sprites:
+                self.sprites.setdefault(int(sprite.center_x // chunk_width), []).append(sprite)
+        self.loaded = {}
+        self.visible = []
+        self.loads = 0
+        self.unloads = 0
+
+    def update(self, left, right):
+        first = int(left // self.chunk_width)
+        last = int(right // self.chunk_width)
+        # соседние куски подгружаются заранее и выгружаются с запасом, чтобы не дёргать их на границе
+        for chunk in [chunk for chunk in self.loaded if chunk < first - 2 or chunk > last + 2]:
+            self.unload(chunk)
+        for chunk in range(first - 1, last + 2):
+            if chunk not in self.loaded and chunk in self.sprites:
+                self.load(chunk)
+        self.visible = [self.loaded[chunk] for chunk in range(first, last + 1) if chunk in self.loaded]
+
+    def load(self, chunk):
+        sprites = self.sprites[chunk]
+        # подобранные и заспавненные тайлы уже удалены из всех списков
+        sprites[:] = [sprite for sprite in sprites if sprite.sprite_lists]
+        sprite_list = new_sprite_list()
+        for sprite in sprites:
+            sprite_list.append(sprite)
+        self.loaded[chunk] = sprite_list
+        self.loads += 1
+
+    def unload(self, chunk):
+        self.loaded.pop(chunk).clear()
+        self.unloads += 1
 
-        def collision(self):
+    def draw(self):
+        for sprite_list in self.visible:
+            sprite_list.draw()
 
-            distances = []
-            for block in self.map.scene["collision"]:
-                distances.append((pow((block.center_x - self.sprite.center_x), 2) + pow(
-                    (block.center_y - self.sprite.center_y), 2)) ** 0.5)
-            block_index = distances.index(min(distances))  
-            block = self.map.scene["collision"][block_index]
+    def report(self):
+        return {"chunks": len(self.sprites), "loaded": len(self.loaded), "visible": len(self.visible),
+                "loads": self.loads, "unloads": self.unloads}
 
 
+class Enemies:
 
-            if not ((block.left <= self.sprite.center_x <= block.right) and (self.sprite.bottom <= block.top)):
-                self.switch_direction()
+    def __init__(self, _map, _bullets):
+        self.map = _map
+        self.bullets = _bullets
+        self.sprites = []
+        self.tex_right = []
+        self.tex_left = []
+        self.attack_texture = []
+        self.type = []
+        self.x = []
+        self.y = []
+        self.previous_x = []
+        self.direction = []
+        self.reload = []
+        self.health = []
+        self.dead = []
+        self.patrol_left = []
+        self.patrol_right = []
+        self.radius = []
+        self.health_bars = None
+        self.health_bar_x = []
+        self.alive = []
+        self.alive_count = 0
+        self.active = []
+        self.wake_timer = 0
+
+    def add(self, sprite, _type, patrol_span):
+        texture_id = textures.id("enemy" + str(_type) + ".png", self.map.level)
+        self.sprites.append(sprite)
+        self.tex_right.append(textures.get(texture_id))
+        self.tex_left.append(textures.get(texture_id, True))
+        self.attack_texture.append(textures.id("enemy" + str(_type) + "_attack.png", self.map.level))
+        self.type.append(_type)
+        self.x.append(sprite.center_x)
+        self.y.append(sprite.center_y)
+        self.previous_x.append(sprite.center_x)
+        self.direction.append(True)
+        self.reload.append(0)
+        self.health.append(ENEMY_HEALTH[_type])
+        self.dead.append(False)
+        self.patrol_left.append(patrol_span[0])
+        self.patrol_right.append(patrol_span[1])
+        self.radius.append(ENEMY_RADIOUS[_type] ** 2)
+        self.alive.append(len(self.sprites) - 1)
+        self.alive_count += 1
+        self.wake_timer = 0
+        if self.health_bars is not None:
+            self.add_health_bar(len(self.sprites) - 1)
+        return len(self.sprites) - 1
+
+    def snapshot(self, buffer):
+        count = len(self.x)
+        active = set(self.active)
+        buffer += struct.pack("<Ii", count, self.wake_timer)
+        buffer += struct.pack(f"<{count}d", *self.x)
+        buffer += struct.pack(f"<{count}d", *self.previous_x)
+        buffer += struct.pack(f"<{count}i", *self.health)
+        buffer += struct.pack(f"<{count}i", *self.reload)
+        buffer += bytes(self.direction[i] | self.dead[i] << 1 | (i in active) << 2 for i in range(count))
+
+    def restore(self, snapshot, offset):
+        count, self.wake_timer = struct.unpack_from("<Ii", snapshot, offset)
+        if count != len(self.x):
+            raise ValueError(f"snapshot has {count} enemies, the map has {len(self.x)}")
+        offset += 8
+        self.x[:] = struct.unpack_from(f"<{count}d", snapshot, offset)
+        self.previous_x[:] = struct.unpack_from(f"<{count}d", snapshot, offset + count * 8)
+        self.health[:] = struct.unpack_from(f"<{count}i", snapshot, offset + count * 16)
+        self.reload[:] = struct.unpack_from(f"<{count}i", snapshot, offset + count * 20)
+        flags = snapshot[offset + count * 24:offset + count * 25]
+        self.direction[:] = [bool(flag & 1) for flag in flags]
+        self.dead[:] = [bool(flag & 2) for flag in flags]
+        self.alive = [i for i in range(count) if not flags[i] & 2]
+        self.alive_count = len(self.alive)
+        self.active = [i for i in range(count) if flags[i] & 4]
+        for i, sprite in enumerate(self.sprites):
+            if self.dead[i]:
+                # у убитых врагов координата целая, как после kill
+                self.x[i] = self.previous_x[i] = ENEMY_DEAD_X
+            sprite.texture = self.tex_right[i] if self.direction[i] else self.tex_left[i]
+            sprite.center_x = self.x[i]
+            sprite.scale = 0 if self.dead[i] else ENEMY_SCALE[self.type[i]]
+        if self.health_bars is not None:
+            for i in range(count):
+                self.health_bars[2 * i].visible = self.health_bars[2 * i + 1].visible = not self.dead[i]
+                self.update_health_bar(i)
+        return offset + count * 25
+
+    def wake(self, player_x):
+        x, previous_x = self.x, self.previous_x
+        distance = enemy_wake_distance()
+        active = [i for i in self.alive if abs(x[i] - player_x) < distance]
+        for i in set(active).difference(self.active):
+            previous_x[i] = x[i]
+        self.active = active
+        self.wake_timer = tick_count(ENEMY_WAKE_INTERVAL)
+
+    def update(self, player_pos):
+        player_x, player_y = player_pos
+        if self.wake_timer <= 0:
+            self.wake(player_x)
+        self.wake_timer -= 1
+        x, y, direction, reload, previous_x = self.x, self.y, self.direction, self.reload, self.previous_x
+        active = self.active
+        for i in active:
+            previous_x[i] = x[i]
+        aggro = [i for i in active if (x[i] - player_x) ** 2 + (y[i] - player_y) ** 2 < self.radius[i]
+                 and abs(y[i] - player_y) < 100]
+        ready = [i for i in aggro if reload[i] == 0]
+        for i in aggro:
+            if reload[i] > 0:
+                reload[i] -= 1
+
+        aggro = set(aggro)
+        patrol = [i for i in active if i not in aggro]
+        speed = per_tick(ENEMY_SPEED)
+        for i in patrol:
+            x[i] += speed if direction[i] else -speed
+            self.sprites[i].center_x = x[i]
+        for i in [i for i in patrol if not (self.patrol_left[i] <= x[i] <= self.patrol_right[i])]:
+            self.switch_direction(i)
+
+        for i in [i for i in ready if (x[i] > player_x and direction[i]) or (x[i] < player_x and not direction[i])]:
+            self.switch_direction(i)
+        for i in ready:
+            reload[i] = tick_count(ENEMY_RELOAD[self.type[i]])
+            self.bullets.spawn_bullet((x[i], y[i]), [-1 if player_x < x[i] else 1, 0], self.attack_texture[i],
+                                      self.type[i], False, 1)
+
+    def interpolate(self, alpha):
+        for i in self.active:
+            self.sprites[i].center_x = lerp(self.previous_x[i], self.x[i], alpha)
 
-        def switch_direction(self):
+    def draw(self):
+        if self.health_bars is None:
+            self.health_bars = arcade.SpriteList()
+            for i in range(len(self.x)):
+                self.add_health_bar(i)
+        for i in self.active:
+            if self.health_bar_x[i] != self.sprites[i].center_x:
+                self.update_health_bar(i)
+        self.health_bars.draw()
+
+    def add_health_bar(self, i):
+        self.health_bars.append(arcade.SpriteSolidColor(128, 15, color=arcade.csscolor.BLACK))
+        self.health_bars.append(arcade.SpriteSolidColor(120, 7, color=arcade.csscolor.RED))
+        self.health_bar_x.append(None)
+        self.update_health_bar(i)
+
+    def update_health_bar(self, i):
+        background = self.health_bars[2 * i]
+        bar = self.health_bars[2 * i + 1]
+        if self.dead[i]:
+            background.visible = False
+            bar.visible = False
+            return
+        x = self.sprites[i].center_x
+        width = 120 * self.health[i] / ENEMY_HEALTH[self.type[i]]
+        background.position = x, self.y[i] + 71.5
+        bar.width = width
+        bar.position = x - 60 + width / 2, self.y[i] + 71.5
+        self.health_bar_x[i] = x
+
+    def switch_direction(self, i):
+        self.direction[i] = not self.direction[i]
+        if self.direction[i]:
+            self.sprites[i].texture = self.tex_right[i]
+        else:
+            self.sprites[i].texture = self.tex_left[i]
+
+    def damage(self, i, damage):
+        if self.dead[i]:
+            return
+        self.health[i] += damage
+        if self.health[i] <= 0:
+            self.kill(i)
+        elif self.health_bars is not None:
+            self.update_health_bar(i)
+
+    def kill(self, i):
+        if self.dead[i]:
+            return
+        self.dead[i] = True
+        self.alive.remove(i)
+        self.alive_count -= 1
+        if i in self.active:
+            self.active.remove(i)
+        self.x[i] = ENEMY_DEAD_X
+        self.previous_x[i] = ENEMY_DEAD_X
+        self.sprites[i].center_x = ENEMY_DEAD_X
+        self.sprites[i].scale = 0
+        if self.health_bars is not None:
+            self.update_health_bar(i)
+        self.map.check_for_level_complete()
+
+
+class Resources:
+
+    def __init__(self, budget=RESOURCE_BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.working_set = set()
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def use(self, name, kind, size, level, evict):
+        # ресурс, взятый без уровня, общий и не выгружается никогда
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                entry = self.entries[name] = {"kind": kind, "size": size, "levels": set(), "shared": False,
+                                              "evict": evict}
+            if level is None:
+                entry["shared"] = True
+            else:
+                entry["levels"].add(level)
+            self.entries.move_to_end(name)
+
+    def enter(self, *levels):
+        self.working_set = set(levels)
+        self.trim()
+
+    def pinned(self, entry):
+        return entry["shared"] or not entry["levels"]
+
+    def resident(self):
+        return sum(entry["size"] for entry in self.entries.values() if not self.pinned(entry))
+
+    def trim(self):
+        with self.lock:
+            resident = self.resident()
+            for name, entry in list(self.entries.items()):
+                if resident <= self.budget:
+                    break
+                if self.pinned(entry) or not entry["levels"].isdisjoint(self.working_set):
+                    continue
+                del self.entries[name]
+                entry["evict"](name)
+                resident -= entry["size"]
+                self.evictions += 1
+
+    def report(self):
+        kinds = {}
+        owners = {}
+        for entry in self.entries.values():
+            kinds[entry["kind"]] = kinds.get(entry["kind"], 0) + entry["size"]
+            if entry["shared"]:
+                owner = "shared"
+            else:
+                owner = ",".join(str(level) for level in sorted(entry["levels"])) or "preloaded"
+            owners[owner] = owners.get(owner, 0) + entry["size"]
+        return {"budget": self.budget, "resident_bytes": self.resident(),
+                "pinned_bytes": sum(kinds.values()) - self.resident(), "evictions": self.evictions,
+                "working_set": sorted(self.working_set), "by_kind": kinds, "by_level": owners}
 
-            if self.direction:
-                self.direction = False
-                self.sprite.texture = self.tex_left
+
+resources = Resources()
+
+
+class Textures:
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.textures = []
+        self.flipped = []
+        self.hits = 0
+        self.misses = 0
+        self.headless = False
+        self.atlas = None
+        self.atlas_dirty = False
+        self.lock = threading.Lock()
+
+    def preload(self, directory, skip=()):
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".png") and name not in self.ids and name not in skip:
+                self.load(name)
+
+    def load(self, name):
+        # фон следующего уровня грузится в потоке LevelLoader, поэтому реестр меняется под замком,
+        # а сама картинка декодируется без него и не задерживает основной поток
+        start = time.perf_counter()
+        if self.headless:
+            with Image.open(IMAGES_DIRECTORY + name) as image:
+                texture = flipped = Bounds(image.width, image.height)
+        else:
+            texture = arcade.load_texture(IMAGES_DIRECTORY + name)
+            flipped = texture.flip_horizontally()
+        with self.lock:
+            texture_id = self.ids.get(name)
+            if texture_id is None:
+                texture_id = self.ids[name] = len(self.textures)
+                self.names.append(name)
+                self.textures.append(texture)
+                self.flipped.append(flipped)
+            else:
+                self.textures[texture_id] = texture
+                self.flipped[texture_id] = flipped
+        startup.asset(name, time.perf_counter() - start)
+        return texture_id
+
+    def evict(self, name):
+        # id остаётся прежним, текстура перечитывается с диска при следующем обращении.
+        # Из атласа текстуры убираются сразу: при сборке мусора изображение умирает раньше текстуры
+        # и атлас не может освободить место
+        with self.lock:
+            texture_id = self.ids[name]
+            texture = self.textures[texture_id]
+            flipped = self.flipped[texture_id]
+            self.textures[texture_id] = None
+            self.flipped[texture_id] = None
+        for variant in (texture, flipped):
+            if self.atlas is not None and self.atlas.has_texture(variant):
+                self.atlas.remove(variant)
+                variant.remove_atlas_ref(self.atlas)
+                self.atlas_dirty = True
+            variant.remove_from_cache()
+        arcade.cache.image_data_cache.delete(arcade.Texture.create_image_cache_name(texture.file_path))
+
+    def compact(self):
+        # место, освобождённое в атласе, снова выделяется только после его перестройки
+        if self.atlas_dirty:
+            self.atlas.rebuild()
+            self.atlas_dirty = False
+
+    def id(self, name, level=None):
+        # resources.use вызывается без замка: Resources.trim держит свой замок и вызывает evict
+        with self.lock:
+            texture_id = self.ids.get(name)
+            missing = texture_id is None or self.textures[texture_id] is None
+            if missing:
+                self.misses += 1
             else:
-                self.direction = True
-                self.sprite.texture = self.tex_right
+                self.hits += 1
+        if missing:
+            texture_id = self.load(name)
+        # текстуру могли выгрузить между загрузкой и учётом; тогда get прочитает её заново
+        texture = self.textures[texture_id]
+        if not self.headless and texture is not None:
+            resources.use(name, "texture", texture.image.width * texture.image.height * 4, level, self.evict)
+        return texture_id
+
+    def get(self, texture_id, flipped=False):
+        # выгруженная текстура читается с диска заново, и это промах, а не попадание
+        if self.textures[texture_id] is None:
+            self.misses += 1
+            self.load(self.names[texture_id])
+        else:
+            self.hits += 1
+        if flipped:
+            return self.flipped[texture_id]
+        return self.textures[texture_id]
+
+    def report(self):
+        return {"textures": len(self.textures), "hits": self.hits, "misses": self.misses}
+
+    def tileset_images(self, directory):
+        # листы тайлсетов целиком нигде не рисуются, в атлас попадают только вырезанные из них тайлы
+        names = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".tsx"):
+                tileset = ElementTree.parse(os.path.join(directory, name)).getroot()
+                names.append(os.path.basename(tileset.find("image").get("source")))
+        return names
+
+    def load_tilesets(self, directory):
+        tiles = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".tsx"):
+                continue
+            tileset = ElementTree.parse(os.path.join(directory, name)).getroot()
+            image = os.path.join(directory, tileset.find("image").get("source"))
+            tile_width = int(tileset.get("tilewidth"))
+            tile_height = int(tileset.get("tileheight"))
+            columns = int(tileset.get("columns"))
+            for local_id in range(int(tileset.get("tilecount"))):
+                tiles.append(arcade.load_texture(image, x=local_id % columns * tile_width,
+                                                 y=local_id // columns * tile_height,
+                                                 width=tile_width, height=tile_height))
+        return tiles
+
+    def pack(self, ctx, tiles=(), standalone=()):
+        # тайлы, персонажи и пули заранее кладутся в один атлас нужного размера, чтобы он не перестраивался
+        # посреди игры; отражённые текстуры используют то же изображение и места не занимают.
+        # Общий атлас создаётся при первом обращении, поэтому размер задаётся до него: resize копирует
+        # содержимое через отрисовку даже у пустого атласа
+        packed = [texture_id for texture_id, name in enumerate(self.names)
+                  if name not in standalone and self.textures[texture_id] is not None]
+        images = [self.textures[texture_id] for texture_id in packed] + list(tiles)
+        size = arcade.TextureAtlas.calculate_minimum_size(images, ATLAS_BORDER)
+        ctx.atlas_size = size
+        atlas = self.atlas = ctx.default_atlas
+        if size[0] > atlas.size[0] or size[1] > atlas.size[1]:
+            atlas.resize(size)
+        for texture in images + [self.flipped[texture_id] for texture_id in packed]:
+            atlas.add(texture)
+        return atlas.size
+
+    def standalone(self, texture):
+        # собственный атлас ровно под одну картинку; он освобождается вместе со списком спрайтов
+        return arcade.TextureAtlas((texture.image.width + 2 * ATLAS_BORDER, texture.image.height + 2 * ATLAS_BORDER),
+                                   border=ATLAS_BORDER, textures=[texture], auto_resize=False)
+
+
+textures = Textures()
+
+
+def new_sprite(texture, scale=1, center_x=0, center_y=0):
+    if textures.headless:
+        return Body(texture, scale, center_x, center_y)
+    return arcade.Sprite(texture, scale, center_x, center_y)
+
+
+def new_sprite_list():
+    if textures.headless:
+        return BodyList()
+    return arcade.SpriteList(lazy=True)
+
+
+class Bounds:
+
+    def __init__(self, width, height, left=None, right=None, bottom=None, top=None):
+        self.width = width
+        self.height = height
+        self.left = -width / 2 if left is None else left
+        self.right = width / 2 if right is None else right
+        self.bottom = -height / 2 if bottom is None else bottom
+        self.top = height / 2 if top is None else top
+
+
+class Body:
+
+    def __init__(self, texture, scale=1, center_x=0, center_y=0):
+        self.texture = texture
+        self.hit_box = texture
+        self.scale = scale
+        self.center_x = center_x
+        self.center_y = center_y
+        self.alpha = 255
+        self.visible = True
+        self.sprite_lists = []
+
+    @property
+    def position(self):
+        return self.center_x, self.center_y
+
+    @position.setter
+    def position(self, position):
+        self.center_x, self.center_y = position
+
+    @property
+    def width(self):
+        return self.texture.width * self.scale
+
+    @property
+    def height(self):
+        return self.texture.height * self.scale
+
+    @property
+    def left(self):
+        return self.center_x + self.hit_box.left * self.scale
+
+    @property
+    def right(self):
+        return self.center_x + self.hit_box.right * self.scale
+
+    @property
+    def bottom(self):
+        return self.center_y + self.hit_box.bottom * self.scale
+
+    @property
+    def top(self):
+        return self.center_y + self.hit_box.top * self.scale
+
+    def remove_from_sprite_lists(self):
+        for sprite_list in self.sprite_lists[:]:
+            sprite_list.remove(self)
+
 
-        def damage_enemy(self, damage):
-            self.health += damage
-            if self.health <= 0:
-                self.kill_enemy()
+class BodyList(list):
 
-        def kill_enemy(self):
-            self.dead = True
-            self.sprite.center_x = -500
-            self.sprite.scale = 0
-            self.map.check_for_level_complete()
+    def append(self, body):
+        super().append(body)
+        body.sprite_lists.append(self)
+
+    def remove(self, body):
+        super().remove(body)
+        body.sprite_lists.remove(self)
+
+    def pop(self, index=-1):
+        body = super().pop(index)
+        body.sprite_lists.remove(self)
+        return body
+
+    def clear(self):
+        for body in self:
+            body.sprite_lists.remove(self)
+        super().clear()
+
+    def draw(self):
+        pass
+
+
+class HeadlessTileMap:
+    tilesets = {}
+
+    def __init__(self, map_file, scaling=1):
+        with open(map_file) as file:
+            data = json.load(file)
+        self.width = data["width"]
+        self.height = data["height"]
+        self.tile_width = data["tilewidth"]
+        self.tile_height = data["tileheight"]
+        self.scaling = scaling
+
+        bounds = {}
+        for tileset in data["tilesets"]:
+            path = os.path.join(os.path.dirname(map_file), tileset["source"])
+            for local_id, tile_bounds in enumerate(self.load_tileset(path)):
+                bounds[tileset["firstgid"] + local_id] = tile_bounds
+
+        self.sprite_lists = {}
+        for layer in data["layers"]:
+            if layer["type"] != "tilelayer":
+                continue
+            sprite_list = BodyList()
+            for index, gid in enumerate(layer["data"]):
+                gid &= 0x1FFFFFFF
+                if gid == 0:
+                    continue
+                column = index % self.width
+                row = self.height - index // self.width - 1
+                sprite_list.append(Body(bounds[gid], scaling, (column + 0.5) * self.tile_width * scaling,
+                                        (row + 0.5) * self.tile_height * scaling))
+            self.sprite_lists[layer["name"]] = sprite_list
+
+    @classmethod
+    def load_tileset(cls, path):
+        if path not in cls.tilesets:
+            tileset = ElementTree.parse(path).getroot()
+            tile_width = int(tileset.get("tilewidth"))
+            tile_height = int(tileset.get("tileheight"))
+            columns = int(tileset.get("columns"))
+            source = tileset.find("image").get("source")
+            tiles = []
+            with Image.open(os.path.join(os.path.dirname(path), source)) as image:
+                alpha = image.convert("RGBA").getchannel("A")
+            for local_id in range(int(tileset.get("tilecount"))):
+                x = local_id % columns * tile_width
+                y = local_id // columns * tile_height
+                box = alpha.crop((x, y, x + tile_width, y + tile_height)).getbbox() or (0, 0, 0, 0)
+                tiles.append(Bounds(tile_width, tile_height, box[0] - tile_width / 2, box[2] - tile_width / 2,
+                                    tile_height / 2 - box[3], tile_height / 2 - box[1]))
+            cls.tilesets[path] = tiles
+        return cls.tilesets[path]
+
+
+class CompiledTileMap:
+
+    def __init__(self, level_file):
+        self.level_file = level_file
+        self.directory = os.path.dirname(level_file)
+        with open(level_file, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offset = 0
+        (self.format, self.version, self.checksum, self.width, self.height,
+         self.tile_width, self.tile_height) = self.read("<4sHI4H")
+        self.sources = []
+        if self.format == LEVEL_FORMAT and self.version == LEVEL_VERSION:
+            self.sources = [self.read_string() for _ in range(self.read("<H")[0])]
+        self.scaling = 1
+        self.sprite_lists = {}
+        self.spawns = []
+        self.enemies = []
+
+    @classmethod
+    def open(cls, map_file, scaling=1):
+        # устаревший, обрезанный или испорченный файл уровня не мешает игре: карта читается из JSON
+        level_file = os.path.splitext(map_file)[0] + LEVEL_EXTENSION
+        if not os.path.exists(level_file):
+            return None
+        tile_map = None
+        try:
+            tile_map = cls(level_file)
+            if tile_map.stale():
+                tile_map.buffer.close()
+                return None
+            tile_map.load(scaling)
+        except (OSError, ValueError, KeyError, struct.error):
+            if tile_map is not None:
+                tile_map.buffer.close()
+            return None
+        return tile_map
+
+    @classmethod
+    def compile(cls, map_file):
+        directory = os.path.dirname(map_file)
+        with open(map_file) as file:
+            data = json.load(file)
+        width = data["width"]
+        height = data["height"]
+        tile_width = data["tilewidth"]
+        tile_height = data["tileheight"]
+
+        sources = [os.path.basename(map_file)]
+        tilesets = bytearray(struct.pack("<H", len(data["tilesets"])))
+        for tileset in data["tilesets"]:
+            path = os.path.join(directory, tileset["source"])
+            root = ElementTree.parse(path).getroot()
+            image = os.path.join(os.path.dirname(path), root.find("image").get("source"))
+            sources += [os.path.relpath(path, directory), os.path.relpath(image, directory)]
+            tiles = HeadlessTileMap.load_tileset(path)
+            tilesets += struct.pack("<I", tileset["firstgid"])
+            tilesets += cls.pack_string(os.path.relpath(image, directory))
+            tilesets += struct.pack("<4H", int(root.get("tilewidth")), int(root.get("tileheight")),
+                                    int(root.get("columns")), len(tiles))
+            for tile in tiles:
+                tilesets += struct.pack("<4f", tile.left, tile.right, tile.bottom, tile.top)
+
+        layers = {layer["name"]: layer["data"] for layer in data["layers"] if layer["type"] == "tilelayer"}
+        for name, gids in layers.items():
+            if any(gid & TILE_FLIP_BITS for gid in gids):
+                raise ValueError(f"{map_file}: layer {name} has flipped tiles, the level format does not support them")
+
+        def center(index):
+            column = index % width
+            row = height - index // width - 1
+            return (column + 0.5) * tile_width, (row + 0.5) * tile_height
+
+        # горизонтальные отрезки коллизий снизу вверх, из них считаются маршруты патрулирования
+        spans = {}
+        collision = layers.get("collision", [0] * (width * height))
+        for row in range(height):
+            line = collision[(height - row - 1) * width:(height - row) * width]
+            column = 0
+            while column < width:
+                if line[column] == 0:
+                    column += 1
+                    continue
+                first = column
+                while column + 1 < width and line[column + 1] != 0:
+                    column += 1
+                spans.setdefault(row, []).append((first, column))
+                column += 1
+
+        def patrol_span(x, y):
+            column = int(x // tile_width)
+            row = int(y // tile_height)
+            while row >= 0:
+                for first, last in spans.get(row, []):
+                    if first <= column <= last:
+                        return first * tile_width, (last + 1) * tile_width
+                row -= 1
+            return x, x
+
+        spawns = [center(index) for index, gid in enumerate(layers.get("spawn", [])) if gid]
+        tables = bytearray(struct.pack("<H", len(spawns)))
+        for x, y in spawns:
+            tables += struct.pack("<2f", x, y)
+        enemies = []
+        for _type in range(0, 6):
+            for index, gid in enumerate(layers.get("enemy" + str(_type), [])):
+                if gid:
+                    x, y = center(index)
+                    enemies.append((_type, x, y) + patrol_span(x, y))
+        tables += struct.pack("<H", len(enemies))
+        for enemy in enemies:
+            tables += struct.pack("<B4f", *enemy)
+
+        level = bytearray(struct.pack("<4sHI4H", LEVEL_FORMAT, LEVEL_VERSION, cls.sources_checksum(directory, sources),
+                                      width, height, tile_width, tile_height))
+        level += struct.pack("<H", len(sources))
+        for source in sources:
+            level += cls.pack_string(source)
+        level += tilesets
+        tile_layers = [name for name in layers if name != "spawn" and not name.startswith("enemy")]
+        level += struct.pack("<H", len(tile_layers))
+        for name in tile_layers:
+            level += cls.pack_string(name)
+            # массивы тайлов выровнены на 4 байта, чтобы читать их из mmap без копирования
+            level += bytes(-len(level) % 4)
+            level += struct.pack(f"<{width * height}I", *layers[name])
+        level += tables
+
+        level_file = os.path.splitext(map_file)[0] + LEVEL_EXTENSION
+        with open(level_file, "wb") as file:
+            file.write(level)
+        return level_file
+
+    @staticmethod
+    def pack_string(text):
+        encoded = text.encode()
+        return struct.pack("<H", len(encoded)) + encoded
+
+    @staticmethod
+    def sources_checksum(directory, sources):
+        checksum = 0
+        for source in sources:
+            with open(os.path.join(directory, source), "rb") as file:
+                checksum = zlib.crc32(file.read(), checksum)
+        return checksum
+
+    def stale(self):
+        if self.format != LEVEL_FORMAT or self.version != LEVEL_VERSION:
+            return True
+        try:
+            return self.checksum != self.sources_checksum(self.directory, self.sources)
+        except OSError:
+            return True
+
+    def read(self, layout):
+        values = struct.unpack_from(layout, self.buffer, self.offset)
+        self.offset += struct.calcsize(layout)
+        return values
+
+    def read_string(self):
+        length = self.read("<H")[0]
+        self.offset += length
+        return self.buffer[self.offset - length:self.offset].decode()
+
+    def load(self, scaling):
+        self.scaling = scaling
+        textures_by_gid = {}
+        for _ in range(self.read("<H")[0]):
+            firstgid = self.read("<I")[0]
+            image = os.path.join(self.directory, self.read_string())
+            tile_width, tile_height, columns, tilecount = self.read("<4H")
+            for local_id in range(tilecount):
+                left, right, bottom, top = self.read("<4f")
+                if textures.headless:
+                    texture = Bounds(tile_width, tile_height, left, right, bottom, top)
+                else:
+                    texture = arcade.load_texture(image, x=local_id % columns * tile_width,
+                                                  y=local_id // columns * tile_height,
+                                                  width=tile_width, height=tile_height)
+                textures_by_gid[firstgid + local_id] = texture
+
+        count = self.width * self.height
+        with memoryview(self.buffer) as view:
+            for _ in range(self.read("<H")[0]):
+                name = self.read_string()
+                self.offset += -self.offset % 4
+                sprite_list = new_sprite_list()
+                if self.offset + count * 4 > len(self.buffer):
+                    raise ValueError(f"{self.level_file} is truncated")
+                with view[self.offset:self.offset + count * 4].cast("I") as gids:
+                    for index, gid in enumerate(gids):
+                        if gid == 0:
+                            continue
+                        if gid & TILE_FLIP_BITS:
+                            raise ValueError(f"{self.level_file} has a flipped tile")
+                        column = index % self.width
+                        row = self.height - index // self.width - 1
+                        sprite_list.append(new_sprite(textures_by_gid[gid], scaling,
+                                                      (column + 0.5) * self.tile_width * scaling,
+                                                      (row + 0.5) * self.tile_height * scaling))
+                self.offset += count * 4
+                self.sprite_lists[name] = sprite_list
+
+        self.spawns = [(x * scaling, y * scaling) for x, y in
+                       struct.iter_unpack("<2f", self.take(self.read("<H")[0] * 8))]
+        self.enemies = [(_type, x * scaling, y * scaling, left * scaling, right * scaling) for _type, x, y, left, right in
+                        struct.iter_unpack("<B4f", self.take(self.read("<H")[0] * 17))]
+        self.buffer.close()
+
+    def take(self, size):
+        if self.offset + size > len(self.buffer):
+            raise ValueError(f"{self.level_file} is truncated")
+        self.offset += size
+        return self.buffer[self.offset - size:self.offset]
+
+    def scene(self):
+        if textures.headless:
+            return self.sprite_lists
+        scene = arcade.Scene()
+        for name, sprite_list in self.sprite_lists.items():
+            scene.add_sprite_list(name, sprite_list=sprite_list)
+        return scene
+
+
+class CollisionGrid:
+
+    def __init__(self, columns, rows, tile_width, tile_height):
+        self.columns = columns
+        self.rows = rows
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.layers = {}
+
+    def add_layer(self, name, sprites):
+        cells = [None] * (self.columns * self.rows)
+        for sprite in sprites:
+            column, row = self.cell(sprite.center_x, sprite.center_y)
+            if 0 <= column < self.columns and 0 <= row < self.rows:
+                cells[row * self.columns + column] = sprite
+        self.layers[name] = cells
+
+    def cell(self, x, y):
+        return int(x // self.tile_width), int(y // self.tile_height)
+
+    def at(self, name, column, row):
+        if 0 <= column < self.columns and 0 <= row < self.rows:
+            return self.layers[name][row * self.columns + column]
+        return None
+
+    def query(self, name, left, bottom, right, top):
+        cells = self.layers[name]
+        first_column = max(int(left // self.tile_width), 0)
+        last_column = min(int(right // self.tile_width), self.columns - 1)
+        first_row = max(int(bottom // self.tile_height), 0)
+        last_row = min(int(top // self.tile_height), self.rows - 1)
+        blocks = []
+        for row in range(first_row, last_row + 1):
+            offset = row * self.columns
+            for column in range(first_column, last_column + 1):
+                block = cells[offset + column]
+                if block is not None:
+                    blocks.append(block)
+        return blocks
+
+    def remove(self, name, sprite):
+        column, row = self.cell(sprite.center_x, sprite.center_y)
+        if self.at(name, column, row) is sprite:
+            self.layers[name][row * self.columns + column] = None
+
+
+class Pickups:
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.callbacks = {}
+        self.cells = None
+        self.pending = []
+        self.collected = 0
+        self.blocks = [(layer, cell, block) for layer in PICKUP_LAYERS
+                       for cell, block in enumerate(grid.layers[layer]) if block is not None]
+
+    def snapshot(self, buffer):
+        buffer += struct.pack("<II", len(self.blocks), self.collected)
+        buffer += bytes(not block.visible for _, _, block in self.blocks)
+
+    def restore(self, snapshot, offset):
+        count, self.collected = struct.unpack_from("<II", snapshot, offset)
+        if count != len(self.blocks):
+            raise ValueError(f"snapshot has {count} pickups, the map has {len(self.blocks)}")
+        offset += 8
+        for (layer, cell, block), collected in zip(self.blocks, snapshot[offset:offset + count]):
+            block.visible = not collected
+            self.grid.layers[layer][cell] = None if collected else block
+        # клетки игрока опрашиваются заново при следующем обновлении
+        self.cells = None
+        self.pending = []
+        return offset + count
+
+    def update(self, sprite):
+        # бонусы не двигаются, поэтому сетка опрашивается только когда игрок переходит в другие клетки;
+        # бонусы из этих клеток ждут, пока хитбоксы действительно пересекутся
+        grid = self.grid
+        cells = (int(sprite.left // grid.tile_width), int(sprite.bottom // grid.tile_height),
+                 int(sprite.right // grid.tile_width), int(sprite.top // grid.tile_height))
+        if cells != self.cells:
+            self.cells = cells
+            self.pending = [(layer, block) for layer in PICKUP_LAYERS
+                            for block in grid.query(layer, sprite.left, sprite.bottom, sprite.right, sprite.top)]
+        if not self.pending:
+            return
+        for layer, block in self.pending[:]:
+            if (sprite.right > block.left and sprite.left < block.right) \
+                    and (sprite.top > block.bottom and sprite.bottom < block.top):
+                self.pending.remove((layer, block))
+                self.collect(layer, block)
+
+    def collect(self, layer, block):
+        # подобранный бонус только прячется, списки спрайтов не перестраиваются
+        self.grid.remove(layer, block)
+        block.visible = False
+        self.collected += 1
+        callback = self.callbacks.get(layer)
+        if callback is not None:
+            callback()
+
+
+class Broadphase:
+
+    def __init__(self, cell_size=BROADPHASE_CELL):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def rebuild(self, xs, indexes, reach):
+        # уровни низкие и широкие, поэтому делим только по x: объект попадает во все столбцы
+        # в пределах досягаемости, и для поиска хватает одного столбца
+        size = self.cell_size
+        self.cells = {}
+        for i in indexes:
+            for column in range(int((xs[i] - reach) // size), int((xs[i] + reach) // size) + 1):
+                self.cells.setdefault(column, []).append(i)
+
+    def at(self, x):
+        return self.cells.get(int(x // self.cell_size))
 
 
 class Bullets:
 
-    def __init__(self, _player, _map):
+    def __init__(self, _player, _map, capacity=BULLETS_CAPACITY):
         self.player = _player
         self.map = _map
-        self.bullet_list = arcade.SpriteList()
-        self.bullets = []
-
-    def draw(self):
-        if len(self.bullet_list) > 0:
+        self.capacity = capacity
+        self.count = 0
+        self.x = []
+        self.y = []
+        self.previous_x = []
+        self.previous_y = []
+        self.velocity_x = []
+        self.velocity_y = []
+        self.damage = []
+        self.lifetime = []
+        self.friendly = []
+        self.scale = []
+        self.texture = []
+        self.sprites = []
+        self.bullet_list = new_sprite_list()
+        self.broadphase = Broadphase()
+
+    def grow(self, size):
+        # списки растут по мере надобности до capacity, как и спрайты, и мир платит только за живые пули
+        for values, default in ((self.x, 0.0), (self.y, 0.0), (self.previous_x, 0.0), (self.previous_y, 0.0),
+                                (self.velocity_x, 0.0), (self.velocity_y, 0.0), (self.damage, 0),
+                                (self.lifetime, 0), (self.friendly, False), (self.scale, 1), (self.texture, 0)):
+            values.extend([default] * (size - len(values)))
+
+    def draw(self, alpha=1):
+        if self.count > 0:
+            self.sync_sprites(alpha)
             self.bullet_list.draw()
 
     def update(self):
-        length = self.bullet_list.__len__()
-        if length > 0:
-            for i in range(0, length):
-                self.bullets[i].update(self.player, self.map.enemys)
-                if self.bullets[i].lifetime <= 0:
-                    self.bullet_list.pop(i)
-                    self.bullets.pop(i)
-                    break  
-
-    def spawn_bullet(self, position, direction, sprite, _type, friendly_bullet, scale):
-        new_bullet = Bullet(position, direction, sprite, BULLETS_SPEED[_type], BULLETS_DAMAGE[_type],
-                            BULLETS_LIFETIME[_type], friendly_bullet, scale)
-        self.bullets.append(new_bullet)
-        self.bullet_list.append(new_bullet.bullet_sprite)
-
-class Bullet:
-    def __init__(self, position, direction, path_to_sprite, speed, damage, lifetime, friendly_button, scale):
-        tex = arcade.load_texture(path_to_sprite)
-        if direction[0] < 0:
-            tex = tex.flip_horizontally()
-        self.bullet_sprite = arcade.Sprite(tex, scale)
-        self.bullet_sprite.position = position
-        self.bullet_direction = direction
-        self.speed = speed
-        self.damage = damage
-        self.lifetime = lifetime
-        self.friendly_button = friendly_button
-
-    def update(self, player, enemy_list):
-        self.bullet_sprite.center_x += (self.bullet_direction[0] * self.speed)
-        self.bullet_sprite.center_y += (self.bullet_direction[1] * self.speed)
-        self.lifetime -= 1
-        if self.friendly_button: 
-            distances = []
-            if enemy_list.__len__() > 0: 
-                for enemy in enemy_list:
-                    distances.append((pow((self.bullet_sprite.position[0] - enemy.sprite.position[0]), 2) + pow(
-                        (self.bullet_sprite.position[1] - enemy.sprite.position[1]), 2)) ** 0.5)
-                min_distance = min(distances)
-                if min_distance < 30 * self.bullet_sprite.scale:
-                    enemy_index = distances.index(min_distance)
-                    enemy_list[enemy_index].damage_enemy(self.damage)
-                    self.lifetime = 0
-        else:  
-            player_pos = player.player_sprite.position
-            distance = (pow((self.bullet_sprite.position[0] - player_pos[0]), 2) + pow(
-                (self.bullet_sprite.position[1] - player_pos[1]), 2)) ** 0.5
-            if distance < 30:
-                player.damage_player(self.damage)
-                self.lifetime = 0
-
+        count = self.count
+        if count == 0:
+            return
+        live = slice(0, count)
+        self.previous_x[live] = self.x[live]
+        self.previous_y[live] = self.y[live]
+        self.x[live] = map(add, self.x[live], self.velocity_x[live])
+        self.y[live] = map(add, self.y[live], self.velocity_y[live])
+        self.lifetime[live] = [lifetime - 1 for lifetime in self.lifetime[live]]
+
+        self.hit_player(count)
+        self.hit_enemies(count)
+        self.compact(count)
+
+    def hit_player(self, count):
+        player_x, player_y = self.player.player_sprite.position
+        # пуля за тик пролетает не больше своей скорости, поэтому хватает проверки конца отрезка
+        reach = BULLETS_RADIUS + per_tick(max(BULLETS_SPEED))
+        x, y, friendly = self.x, self.y, self.friendly
+        for i in [i for i in range(count) if not friendly[i]
+                  and abs(x[i] - player_x) < reach and abs(y[i] - player_y) < reach]:
+            if swept_hit(self.previous_x[i], self.previous_y[i], x[i], y[i],
+                         player_x, player_y, BULLETS_RADIUS) is not None:
+                self.player.damage_player(self.damage[i])
+                self.lifetime[i] = 0
+
+    def hit_enemies(self, count):
+        enemies = self.map.enemies
+        alive = enemies.alive
+        if enemies.alive_count == 0:
+            return
+        reach = BULLETS_RADIUS * max(self.scale[:count]) + per_tick(max(BULLETS_SPEED))
+        left = min(enemies.x[i] for i in alive) - reach
+        right = max(enemies.x[i] for i in alive) + reach
+        bottom = min(enemies.y[i] for i in alive) - reach
+        top = max(enemies.y[i] for i in alive) + reach
+        x, y, scale, friendly = self.x, self.y, self.scale, self.friendly
+        bullets = [i for i in range(count) if friendly[i] and left < x[i] < right and bottom < y[i] < top]
+        if len(bullets) == 0:
+            return
+
+        self.broadphase.rebuild(enemies.x, alive, reach)
+        at = self.broadphase.at
+        previous_x, previous_y = self.previous_x, self.previous_y
+        for i, candidates in [(i, candidates) for i in bullets if (candidates := at(x[i]))]:
+            radius = BULLETS_RADIUS * scale[i]
+            x0, y0, x1, y1 = previous_x[i], previous_y[i], x[i], y[i]
+            hit = None
+            hit_time = 1
+            for enemy in candidates:
+                if enemies.dead[enemy]:
+                    continue
+                t = swept_hit(x0, y0, x1, y1, enemies.x[enemy], enemies.y[enemy], radius)
+                if t is not None and t < hit_time:
+                    hit = enemy
+                    hit_time = t
+            if hit is not None:
+                enemies.damage(hit, self.damage[i])
+                self.lifetime[i] = 0
+
+    def compact(self, count):
+        lifetime = self.lifetime
+        for i in [i for i in range(count - 1, -1, -1) if lifetime[i] <= 0]:
+            last = self.count - 1
+            if i != last:
+                self.move(last, i)
+            self.sprites[last].visible = False
+            self.count = last
+
+    def move(self, source, target):
+        self.x[target] = self.x[source]
+        self.y[target] = self.y[source]
+        self.previous_x[target] = self.previous_x[source]
+        self.previous_y[target] = self.previous_y[source]
+        self.velocity_x[target] = self.velocity_x[source]
+        self.velocity_y[target] = self.velocity_y[source]
+        self.damage[target] = self.damage[source]
+        self.lifetime[target] = self.lifetime[source]
+        self.friendly[target] = self.friendly[source]
+        self.scale[target] = self.scale[source]
+        self.texture[target] = self.texture[source]
+        self.sprites[target].texture = self.sprites[source].texture
+        self.sprites[target].scale = self.scale[source]
+
+    def sync_sprites(self, alpha=1):
+        if alpha >= 1:
+            for sprite, x, y in zip(self.sprites[:self.count], self.x, self.y):
+                sprite.position = x, y
+        else:
+            for sprite, x, y, previous_x, previous_y in zip(self.sprites[:self.count], self.x, self.y,
+                                                            self.previous_x, self.previous_y):
+                sprite.position = lerp(previous_x, x, alpha), lerp(previous_y, y, alpha)
+
+    def spawn_bullet(self, position, direction, texture_id, _type, friendly_bullet, scale):
+        if self.count >= self.capacity:
+            return
+        i = self.count
+        if i == len(self.x):
+            self.grow(i + 1)
+        texture = textures.get(texture_id, direction[0] < 0)
+        if i == len(self.sprites):
+            self.sprites.append(new_sprite(texture, scale))
+            self.bullet_list.append(self.sprites[i])
+        else:
+            self.sprites[i].texture = texture
+            self.sprites[i].scale = scale
+            self.sprites[i].visible = True
+
+        self.x[i] = position[0]
+        self.y[i] = position[1]
+        self.previous_x[i] = position[0]
+        self.previous_y[i] = position[1]
+        speed = per_tick(BULLETS_SPEED[_type])
+        self.velocity_x[i] = direction[0] * speed
+        self.velocity_y[i] = direction[1] * speed
+        self.damage[i] = BULLETS_DAMAGE[_type]
+        self.lifetime[i] = tick_count(BULLETS_LIFETIME[_type])
+        self.friendly[i] = friendly_bullet
+        self.scale[i] = scale
+        # id текстуры и признак отражения, чтобы снимок мог восстановить спрайт
+        self.texture[i] = texture_id * 2 + (direction[0] < 0)
+        self.count += 1
+
+    def snapshot(self, buffer):
+        live = slice(0, self.count)
+        buffer += struct.pack("<I", self.count)
+        for values in (self.x, self.y, self.previous_x, self.previous_y, self.velocity_x, self.velocity_y,
+                       self.scale):
+            buffer += struct.pack(f"<{self.count}d", *values[live])
+        buffer += struct.pack(f"<{self.count}i", *self.damage[live])
+        buffer += struct.pack(f"<{self.count}i", *self.lifetime[live])
+        buffer += struct.pack(f"<{self.count}I", *self.texture[live])
+        buffer += struct.pack(f"<{self.count}?", *self.friendly[live])
+
+    def restore(self, snapshot, offset):
+        previous_count = self.count
+        count = self.count = struct.unpack_from("<I", snapshot, offset)[0]
+        offset += 4
+        self.grow(count)
+        live = slice(0, count)
+        for values in (self.x, self.y, self.previous_x, self.previous_y, self.velocity_x, self.velocity_y,
+                       self.scale):
+            values[live] = struct.unpack_from(f"<{count}d", snapshot, offset)
+            offset += count * 8
+        self.damage[live] = struct.unpack_from(f"<{count}i", snapshot, offset)
+        self.lifetime[live] = struct.unpack_from(f"<{count}i", snapshot, offset + count * 4)
+        self.texture[live] = struct.unpack_from(f"<{count}I", snapshot, offset + count * 8)
+        self.friendly[live] = struct.unpack_from(f"<{count}?", snapshot, offset + count * 12)
+        for i in range(count):
+            texture = textures.get(self.texture[i] >> 1, self.texture[i] & 1)
+            if i == len(self.sprites):
+                self.sprites.append(new_sprite(texture, self.scale[i]))
+                self.bullet_list.append(self.sprites[i])
+            else:
+                self.sprites[i].texture = texture
+                self.sprites[i].scale = self.scale[i]
+                self.sprites[i].visible = True
+        for i in range(count, previous_count):
+            self.sprites[i].visible = False
+        return offset + count * 13
 
 
 class Camera:
-    def __init__(self):
+    def __init__(self, lazy=STARTUP_LAZY):
         self.position_x = 0
+        self.position = (0, 0)
+        self.previous_position = (0, 0)
         self.bg_camera = None
         self.main_camera = None
         self.gui_camera = None
         self.player = None
         self.bg_list = None
+        self.prepared = {}
         self.player_health = arcade.SpriteList()
-        self.player_health.append(arcade.Sprite(IMAGES_DIRECTORY + "player_health.png", 2, 90, 50))
-        self.welcome_screen = arcade.SpriteList()
-        self.welcome_screen.append(
-            arcade.Sprite(IMAGES_DIRECTORY + "start_screen.png", 1, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2))
-        self.win_screen = arcade.SpriteList()
-        self.win_screen.append(
-            arcade.Sprite(IMAGES_DIRECTORY + "win_screen.png", 1, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2))
-        self.next_level_screen = arcade.SpriteList()
-        self.next_level_screen.append(
-            arcade.Sprite(IMAGES_DIRECTORY + "next_level_screen.png", 1, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2))
-        self.lose_screen = arcade.SpriteList()
-        self.lose_screen.append(
-            arcade.Sprite(IMAGES_DIRECTORY + "lose_screen.png", 1, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2))
-        self.start_game = arcade.Text("Начать игру", int(SCREEN_WIDTH / 2 - 180), int(SCREEN_HEIGHT / 2 - 250),
-                                      arcade.color.AQUA, 64, None, "center",
-                                      "impact", True)
-        self.restart = arcade.Text("Рестарт", int(SCREEN_WIDTH / 2 - 130), int(SCREEN_HEIGHT / 2 - 250),
-                                   arcade.color.YELLOW, 64, None, "center",
-                                   "impact", True)
-        self.exit_game = arcade.Text("Выход", int(SCREEN_WIDTH / 2 - 100), int(SCREEN_HEIGHT / 2 - 350),
-                                     arcade.color.RED,
-                                     64, None, "center", "impact", True)
+        self.player_health.append(arcade.Sprite(textures.get(textures.id("player_health.png")), 2, 90, 50))
+        self.health_bar = arcade.SpriteSolidColor(92, 12, color=arcade.csscolor.GREEN)
+        self.player_health.append(self.health_bar)
+        self.shown_health = None
+        self.screens = {}
+        self.texts = {}
+        if not lazy:
+            for name in ["start_screen.png", "win_screen.png", "next_level_screen.png", "lose_screen.png"]:
+                self.screen(name)
+            for name in CAMERA_TEXTS:
+                self.text(name)
+
+    def screen(self, name):
+        screen = self.screens.get(name)
+        if screen is None:
+            texture = textures.get(textures.id(name))
+            start = time.perf_counter()
+            screen = arcade.SpriteList(atlas=textures.standalone(texture))
+            screen.append(arcade.Sprite(texture, 1, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2))
+            self.screens[name] = screen
+            startup.asset("screen " + name, time.perf_counter() - start)
+        return screen
+
+    def text(self, name):
+        text = self.texts.get(name)
+        if text is None:
+            start = time.perf_counter()
+            label, x, y, color = CAMERA_TEXTS[name]
+            text = arcade.Text(label, int(SCREEN_WIDTH / 2 + x), int(SCREEN_HEIGHT / 2 + y),
+                               color, 64, None, "center", "impact", True)
+            self.texts[name] = text
+            startup.asset("text " + name, time.perf_counter() - start)
+        return text
+
     def setup(self, player, map_index):
 
         self.bg_camera = arcade.Camera()
         self.main_camera = arcade.Camera()
         self.gui_camera = arcade.Camera()
 
-        self.bg_list = []
-        self.bg_list.append(
-            arcade.load_texture(IMAGES_DIRECTORY + f"levelbg{map_index}.png"))  
+        self.bg_list = self.prepared.pop(map_index, None) or self.background(map_index)
+        self.prepared.clear()
         self.map_index = map_index
         self.player = player
+        self.reset()
+
+    def reset(self):
+        # уровень и повторная попытка открываются с того же вида, что и первый запуск, а не с прошлого уровня
+        self.position = (0, 0)
+        self.previous_position = self.position
+
+    def background(self, map_index):
+        texture = textures.get(textures.id(BACKGROUND_IMAGES[map_index], map_index))
+        bg_list = arcade.SpriteList(atlas=textures.standalone(texture))
+        background = arcade.Sprite(texture, 1, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2)
+        background.width = SCREEN_WIDTH
+        background.height = SCREEN_HEIGHT
+        bg_list.append(background)
+        return bg_list
+
+    def prepare(self, map_index):
+        # фон следующего уровня попадает на видеокарту, пока показан экран победы, а не при смене уровня
+        if map_index not in self.prepared:
+            self.prepared[map_index] = self.background(map_index)
 
     def update(self, left_border):
         self.center_camera_to_position(self.player.player_sprite.position)
     def center_camera_to_position(self, position):
-        screen_center_x = self.lerp(self.main_camera.position[0], position[0] - (SCREEN_WIDTH / 2), 0.1)
-        screen_center_y = self.lerp(self.main_camera.position[1], position[1] - (SCREEN_HEIGHT / 2), 0.1)
-        self.main_camera.move_to([screen_center_x, screen_center_y])
+        self.previous_position = self.position
+        screen_center_x = lerp(self.position[0], position[0] - (SCREEN_WIDTH / 2), 0.1)
+        screen_center_y = lerp(self.position[1], position[1] - (SCREEN_HEIGHT / 2), 0.1)
+        self.position = (screen_center_x, screen_center_y)
+
+    def interpolate(self, alpha):
+        self.main_camera.move_to([lerp(self.previous_position[0], self.position[0], alpha),
+                                  lerp(self.previous_position[1], self.position[1], alpha)])
 
     def move_camera(self, speed, player_pos):
         position = self.position_x, 0
         self.main_camera.move_to(position)
     def draw_bg(self):
-       
-        arcade.draw_texture_rectangle(SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2, SCREEN_WIDTH, SCREEN_HEIGHT, self.bg_list[0])
-    def draw_gui(self):
+        self.bg_list.draw()
 
-      
-        health_offset = [55, 30]
-        size = [100, 20]
+    def draw_gui(self):
+        if self.player.health != self.shown_health:
+            self.shown_health = self.player.health
+            health_offset = [55, 30]
+            size = [100, 20]
+            width = (size[0] - 8) * self.player.health / PLAYER_MAX_HEALTH
+            self.health_bar.width = width
+            self.health_bar.position = (health_offset[0] + 4 + width / 2,
+                                        health_offset[1] + 4 + (size[1] - 8) / 2)
         self.player_health.draw()
 
-        arcade.draw_xywh_rectangle_filled(health_offset[0] + 4,
-                                          health_offset[1] + 4, (size[0] - 8) * self.player.health / PLAYER_MAX_HEALTH,
-                                          size[1] - 8, arcade.csscolor.GREEN)
-
         if not self.player.game_started:
             if self.map_index > 0:
-                self.next_level_screen.draw()
+                self.screen("next_level_screen.png").draw()
             else:
-                self.welcome_screen.draw()
-                self.start_game.draw()
-                self.exit_game.draw()
+                self.screen("start_screen.png").draw()
+                self.text("start_game").draw()
+                self.text("exit_game").draw()
 
         elif self.player.game_lose:
-            self.lose_screen.draw()
-            self.restart.draw()
-            self.exit_game.draw()
+            self.screen("lose_screen.png").draw()
+            self.text("restart").draw()
+            self.text("exit_game").draw()
         elif self.player.game_win:
-            self.win_screen.draw()
-    def lerp(self, a, b, t):
-        return (1 - t) * a + t * b
+            self.screen("win_screen.png").draw()
+
+
+class Sounds:
+
+    def __init__(self, streaming=MUSIC_STREAMING):
+        self.streaming = streaming
+        self.sounds = {}
+        self.bytes = {}
+        self.load_times = {}
+        self.loads = {}
+        self.uses = {}
+        self.lock = threading.Lock()
+
+    def load(self, name):
+        start = time.perf_counter()
+        sound = arcade.load_sound(AUDIO_DIRECTORY + name, self.streaming)
+        seconds = time.perf_counter() - start
+        startup.asset(name, seconds)
+        # LevelLoader загружает музыку из потока, поэтому счётчики меняются под блокировкой
+        with self.lock:
+            self.load_times[name] = self.load_times.get(name, 0) + seconds
+            self.loads[name] = self.loads.get(name, 0) + 1
+            self.bytes[name] = 0 if self.streaming else len(sound.source._data)
+        return sound
+
+    def get(self, name, level=None):
+        with self.lock:
+            sound = self.sounds.get(name)
+            self.uses[name] = self.uses.get(name, 0) + 1
+        if sound is None:
+            sound = self.load(name)
+            with self.lock:
+                sound = self.sounds.setdefault(name, sound)
+        elif self.streaming and not sound.source.is_player_source:
+            # потоковый источник играет только в одном плеере; после остановки плеера его достаточно перемотать
+            sound.source.seek(0)
+        resources.use(name, "sound", self.bytes[name], level, self.evict)
+        return sound
+
+    def evict(self, name):
+        with self.lock:
+            self.sounds.pop(name, None)
+
+    def report(self):
+        return {
+            "streaming": self.streaming,
+            "bytes": sum(self.bytes.values()),
+            "tracks": {name: {"bytes": self.bytes[name], "loads": self.loads[name], "uses": self.uses.get(name, 0),
+                              "load_ms": self.load_times[name] * 1000} for name in self.loads},
+        }
+
+
+sounds = Sounds()
+
+
+class Profiler:
+
+    def __init__(self, window=PROFILER_WINDOW):
+        self.enabled = False
+        self.samples = {phase: deque(maxlen=window) for phase in PROFILER_PHASES + ["frame"]}
+        self.frame = dict.fromkeys(PROFILER_PHASES, 0)
+        self.counts = dict.fromkeys(PROFILER_COUNTS, 0)
+        self.records = deque(maxlen=PROFILER_RECORDS)
+        self.frames = 0
+        self.started = 0
+        self.text = None
+
+    def mark(self):
+        if self.enabled:
+            self.started = time.perf_counter_ns()
+
+    def lap(self, phase):
+        if self.enabled:
+            now = time.perf_counter_ns()
+            self.frame[phase] += now - self.started
+            self.started = now
+
+    def end_frame(self, counts):
+        self.frames += 1
+        times = [self.frame[phase] / 1e6 for phase in PROFILER_PHASES]
+        for phase, milliseconds in zip(PROFILER_PHASES, times):
+            self.samples[phase].append(milliseconds)
+            self.frame[phase] = 0
+        self.samples["frame"].append(sum(times))
+        self.counts = counts
+        self.records.append([self.frames] + times + [counts[name] for name in PROFILER_COUNTS])
+
+    def percentiles(self, phase):
+        samples = sorted(self.samples[phase])
+        if not samples:
+            return 0, 0, 0
+        return tuple(samples[min(int(len(samples) * p), len(samples) - 1)] for p in (0.5, 0.95, 0.99))
+
+    def draw(self):
+        if self.text is None:
+            self.text = arcade.Text("", 10, SCREEN_HEIGHT - 20, arcade.color.WHITE, 11, 360,
+                                    multiline=True, font_name="monospace")
+        if self.frames % PROFILER_REFRESH == 1:
+            lines = [f"{'ms':<14}{'p50':>7}{'p95':>7}{'p99':>7}"]
+            for phase in PROFILER_PHASES + ["frame"]:
+                lines.append(f"{phase:<14}" + "".join(f"{value:7.2f}" for value in self.percentiles(phase)))
+            lines.append("  ".join(f"{name} {self.counts[name]}" for name in PROFILER_COUNTS))
+            self.text.text = "\n".join(lines)
+        self.text.draw()
+
+    def dump(self, path=PROFILER_CSV):
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["frame"] + [phase + "_ms" for phase in PROFILER_PHASES] + PROFILER_COUNTS)
+            writer.writerows(self.records)
+        return path
+
+
+profiler = Profiler()
+
+
+class Startup:
+
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+        self.phases = {}
+        self.assets = {}
+        self.deferred = {}
+        self.first_frame = None
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = now - self.last
+        self.last = now
+
+    def asset(self, name, seconds):
+        # всё, что загрузилось после первого кадра, считается отложенным
+        assets = self.assets if self.first_frame is None else self.deferred
+        assets[name] = assets.get(name, 0) + seconds
+
+    def finish(self):
+        self.lap("first_frame")
+        self.first_frame = self.last - self.started
+
+    def report(self):
+        return {
+            "first_frame_ms": (self.first_frame or 0) * 1000,
+            "phases_ms": {phase: seconds * 1000 for phase, seconds in self.phases.items()},
+            "assets_ms": {name: seconds * 1000 for name, seconds in self.assets.items()},
+            "deferred_ms": {name: seconds * 1000 for name, seconds in self.deferred.items()},
+        }
+
+
+startup = Startup(STARTED)
 
 
 class Audio:
 
     def __init__(self):
         self.music = None
-        self.sounds = None
+        self.level = None
         self.media_player = None
         self.isPlaying = False
 
-    def setup(self):
-        self.music = [arcade.load_sound(AUDIO_DIRECTORY + "game_level_0.mp3"),
-                      arcade.load_sound(AUDIO_DIRECTORY + "game_level_1.mp3"),
-                      arcade.load_sound(AUDIO_DIRECTORY + "game_level_2.mp3")]
+    def setup(self, level):
+        self.level = level
+        self.music = sounds.get(MUSIC[level], level)
 
     def play_music(self, level):
         if self.isPlaying:
             self.stop_music()
-        self.media_player = self.music[level].play()
+        if self.music is None or self.level != level:
+            self.setup(level)
+        self.media_player = self.music.play()
         self.isPlaying = True
+        if sounds.streaming:
+            self.music = None
 
     def stop_music(self):
         if self.isPlaying:
             arcade.stop_sound(self.media_player)
         self.isPlaying = False
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import json
+import random
+import time
+
+import pyglet
+
+pyglet.options["shadow_window"] = False
+
+import arcade
+import game
+
+KEYS = {
+    "UP": arcade.key.UP,
+    "LEFT": arcade.key.LEFT,
+    "RIGHT": arcade.key.RIGHT,
+    "SPACE": arcade.key.SPACE,
+}
+
+
+def new_world(level, map_file=None, seed=None):
+    game.textures.headless = True
+    world = game.World(level, map_file=map_file, seed=seed)
+    world.player.game_started = True
+    return world
+
+
+def start_world(level, seed=None, starts=None):
+    # уровень читается с диска один раз на словарь starts, дальше эпизод начинается с восстановления снимка;
+    # конструктор мира не тратит случайные числа, поэтому снимок с новым seed совпадает со свежей загрузкой
+    if starts is None:
+        starts = {}
+    if level not in starts:
+        world = new_world(level)
+        starts[level] = world, world.snapshot()
+    world, snapshot = starts[level]
+    world.restore(snapshot)
+    world.random.seed(seed)
+    return world
+
+
+class RandomInput:
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self.held = None
+
+    def events(self, tick):
+        events = []
+        if self.random.random() < 0.02:
+            if self.held is not None:
+                events.append(("release", self.held))
+            self.held = self.random.choice([KEYS["RIGHT"], KEYS["RIGHT"], KEYS["LEFT"], None])
+            if self.held is not None:
+                events.append(("press", self.held))
+        if self.random.random() < 0.03:
+            events.append(("press", KEYS["UP"]))
+        elif self.random.random() < 0.05:
+            events.append(("release", KEYS["UP"]))
+        if self.random.random() < 0.1:
+            events.append(("press", KEYS["SPACE"]))
+        return events
+
+
+class ScriptedInput:
+
+    def __init__(self, script):
+        self.script = {}
+        for tick, action, key in script:
+            self.script.setdefault(tick, []).append((action, KEYS[key] if isinstance(key, str) else key))
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as file:
+            return cls(json.load(file))
+
+    def events(self, tick):
+        return self.script.get(tick, [])
+
+
+def episode_seed(seed, episode):
+    if seed is None:
+        return None
+    return seed + episode
+
+
+def run(level, ticks, inputs, seed=None):
+    starts = {}
+    world = start_world(level, episode_seed(seed, 0), starts)
+    result = {"level": level, "ticks": ticks, "episodes": 0, "wins": 0, "losses": 0}
+
+    start = time.perf_counter()
+    for tick in range(ticks):
+        world.apply(inputs.events(tick))
+        world.tick()
+        if not world.running():
+            result["wins"] += world.player.game_win
+            result["losses"] += world.player.game_lose
+            result["episodes"] += 1
+            world = start_world(level, episode_seed(seed, result["episodes"]), starts)
+    result["seconds"] = time.perf_counter() - start
+    result["ticks_per_second"] = ticks / result["seconds"]
+    return result
+
+
+def record(level, ticks, inputs, seed, path):
+    world = new_world(level, seed=seed)
+    world.recording = game.Recording(level, seed)
+    for tick in range(ticks):
+        world.apply(inputs.events(tick))
+        if not world.tick():
+            break
+    world.recording.finish(world)
+    world.recording.save(path)
+    return {"level": level, "ticks": world.ticks, "events": len(world.recording.events), "recording": path}
+
+
+def rollback(level, ticks, inputs, seed, depth):
+    # каждые depth тиков мир откатывается к снимку depth тиков назад и пересчитывается с тем же вводом
+    world = new_world(level, seed=seed)
+    snapshots = []
+    events = []
+    result = {"level": level, "depth": depth, "snapshots": 0, "rollbacks": 0, "verified": True}
+    snapshot_time = 0
+    restore_time = 0
+    for tick in range(ticks):
+        start = time.perf_counter()
+        snapshots.append(world.snapshot())
+        snapshot_time += time.perf_counter() - start
+        events.append(inputs.events(tick))
+        world.apply(events[-1])
+        if not world.tick():
+            break
+        if len(snapshots) == depth:
+            expected = world.checksum()
+            start = time.perf_counter()
+            world.restore(snapshots[0])
+            restore_time += time.perf_counter() - start
+            for tick_events in events:
+                world.apply(tick_events)
+                world.tick()
+            result["verified"] = result["verified"] and world.checksum() == expected
+            result["rollbacks"] += 1
+            result["snapshots"] += len(snapshots)
+            snapshots = []
+            events = []
+    result["snapshot_bytes"] = len(world.snapshot())
+    result["snapshot_us"] = snapshot_time / max(result["snapshots"], 1) * 1e6
+    result["restore_us"] = restore_time / max(result["rollbacks"], 1) * 1e6
+    return result
+
+
+def replay(path, realtime=False):
+    recording = game.Recording.load(path)
+    game.set_tick_rate(recording.tick_rate)
+    world = new_world(recording.level, seed=recording.seed)
+    start = time.perf_counter()
+    while world.ticks < recording.ticks:
+        world.apply(recording.events_at(world.ticks))
+        if not world.tick():
+            break
+        if realtime:
+            time.sleep(max(start + world.ticks / game.TICK_RATE - time.perf_counter(), 0))
+    seconds = time.perf_counter() - start
+    return {
+        "level": recording.level,
+        "ticks": world.ticks,
+        "verified": world.ticks == recording.ticks and world.checksum() == recording.checksum,
+        "seconds": seconds,
+        "ticks_per_second": world.ticks / seconds if seconds else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run World of Chaos levels without a window")
+    parser.add_argument("--level", type=int, action="append", help="level index, may be repeated")
+    parser.add_argument("--ticks", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--script", help="JSON list of [tick, \"press\"|\"release\", key] events")
+    parser.add_argument("--record", help="record one run of the first level to this file")
+    parser.add_argument("--replay", help="replay a recording uncapped and verify its final state")
+    parser.add_argument("--realtime", action="store_true", help="pace --replay at the simulation tick rate")
+    parser.add_argument("--rollback", type=int, metavar="TICKS",
+                        help="snapshot every tick and resimulate every TICKS ticks, verifying the state")
+    args = parser.parse_args()
+
+    if args.replay:
+        print(json.dumps(replay(args.replay, args.realtime)))
+        return
+    for level in args.level or [0, 1, 2]:
+        if args.script:
+            inputs = ScriptedInput.from_file(args.script)
+        else:
+            inputs = RandomInput(args.seed)
+        if args.record:
+            print(json.dumps(record(level, args.ticks, inputs, args.seed, args.record)))
+            return
+        if args.rollback:
+            print(json.dumps(rollback(level, args.ticks, inputs, args.seed, args.rollback)))
+            continue
+        print(json.dumps(run(level, args.ticks, inputs, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+import time
+import zlib
+
+import headless
+import game
+
+SERVER_FORMAT = b"WOCN"
+SERVER_VERSION = 1
+HELLO = struct.Struct("<4sHBI")
+EVENT = struct.Struct("<BI")
+UPDATE = struct.Struct("<IIII")
+
+# Состояние уходит клиентам раз в SEND_INTERVAL тиков
+SEND_INTERVAL = 3
+
+
+def delta(previous, state):
+    # XOR с прошлым состоянием почти весь из нулей и хорошо сжимается; длина меняется вместе с числом пуль
+    size = len(state)
+    previous = previous[:size].ljust(size, b"\0")
+    xor = int.from_bytes(previous, "little") ^ int.from_bytes(state, "little")
+    return zlib.compress(xor.to_bytes(size, "little"), 1)
+
+
+def undelta(previous, payload, size):
+    previous = previous[:size].ljust(size, b"\0")
+    xor = int.from_bytes(zlib.decompress(payload), "little")
+    return (int.from_bytes(previous, "little") ^ xor).to_bytes(size, "little")
+
+
+def level_exists(level):
+    return os.path.exists(game.MAPS_DIRECTORY + f"map{level}.json")
+
+
+class Session:
+
+    def __init__(self, writer, starts, level, seed):
+        self.writer = writer
+        self.level = level
+        self.seed = seed
+        self.episodes = 0
+        self.starts = starts
+        self.world = headless.start_world(level, seed, starts)
+        self.events = []
+        self.previous = b""
+        self.sent = asyncio.Event()
+        self.ticks = 0
+        self.seconds = 0
+        self.updates = 0
+        self.skipped = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def step(self, send):
+        start = time.perf_counter()
+        self.world.apply(self.events)
+        self.events = []
+        if not self.world.tick():
+            self.episodes += 1
+            self.world = headless.start_world(self.level, self.seed, self.starts)
+        self.ticks += 1
+        if send and self.sent.is_set():
+            # клиент ещё не принял прошлое обновление; следующее уйдёт XOR-ом от последнего отправленного
+            self.skipped += 1
+        elif send:
+            # клиенту не нужен генератор случайных чисел, поэтому уходит только видимое состояние
+            state = self.world.state()
+            payload = delta(self.previous, state)
+            self.writer.write(UPDATE.pack(self.world.ticks, len(state), zlib.crc32(state), len(payload)))
+            self.writer.write(payload)
+            self.previous = state
+            self.sent.set()
+            self.updates += 1
+            self.raw_bytes += len(state)
+            self.sent_bytes += UPDATE.size + len(payload)
+        self.seconds += time.perf_counter() - start
+
+    async def flush(self):
+        # после каждой отправки буфер сокета сливается отдельно для каждого клиента,
+        # поэтому медленный клиент не задерживает тики остальных
+        try:
+            while True:
+                await self.sent.wait()
+                await self.writer.drain()
+                self.sent.clear()
+        except ConnectionError:
+            pass
+
+
+class Server:
+
+    def __init__(self, tick_rate=game.TICK_RATE, send_interval=SEND_INTERVAL):
+        # скорости и таймеры мира пересчитываются в тики по этой частоте
+        game.set_tick_rate(tick_rate)
+        self.tick_time = 1 / tick_rate
+        self.send_interval = send_interval
+        self.sessions = []
+        self.finished = []
+        self.ticks = 0
+        self.late_ticks = 0
+        self.busy = 0
+        self.rejected = 0
+
+    async def handle(self, reader, writer):
+        try:
+            magic, version, level, seed = HELLO.unpack(await reader.readexactly(HELLO.size))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            magic = None
+        if magic != SERVER_FORMAT or version != SERVER_VERSION or not level_exists(level):
+            self.rejected += 1
+            writer.close()
+            return
+        # уровень читается с диска в пуле потоков, чтобы тики остальных сессий не ждали загрузки
+        loop = asyncio.get_running_loop()
+        starts = {}
+        try:
+            await loop.run_in_executor(None, headless.start_world, level, seed, starts)
+        except (OSError, ValueError, KeyError):
+            self.rejected += 1
+            writer.close()
+            return
+        session = Session(writer, starts, level, seed)
+        self.sessions.append(session)
+        flush = asyncio.create_task(session.flush())
+        try:
+            while True:
+                action, key = EVENT.unpack(await reader.readexactly(EVENT.size))
+                if action >= len(game.REPLAY_ACTIONS):
+                    break
+                session.events.append((game.REPLAY_ACTIONS[action], key))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            flush.cancel()
+            self.sessions.remove(session)
+            self.finished.append(session)
+            writer.close()
+
+    async def run(self):
+        # фиксированный шаг: тик назначается по расписанию, а не через tick_time после конца предыдущего
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            start = time.perf_counter()
+            send = self.ticks % self.send_interval == 0
+            for session in self.sessions:
+                session.step(send)
+            self.ticks += 1
+            self.busy += time.perf_counter() - start
+            deadline += self.tick_time
+            delay = deadline - loop.time()
+            if delay < 0:
+                self.late_ticks += 1
+                deadline = loop.time()
+            await asyncio.sleep(max(delay, 0))
+
+    def report(self, seconds):
+        sessions = self.sessions + self.finished
+        ticks = sum(session.ticks for session in sessions)
+        updates = sum(session.updates for session in sessions)
+        raw_bytes = sum(session.raw_bytes for session in sessions)
+        sent_bytes = sum(session.sent_bytes for session in sessions)
+        return {
+            "sessions": len(sessions),
+            "rejected": self.rejected,
+            "server_ticks": self.ticks,
+            "ticks_per_second": self.ticks / seconds,
+            "late_ticks": self.late_ticks,
+            "tick_load": self.busy / seconds,
+            "us_per_session_tick": sum(session.seconds for session in sessions) / ticks * 1e6 if ticks else 0,
+            "episodes": sum(session.episodes for session in sessions),
+            "updates": updates,
+            "skipped_updates": sum(session.skipped for session in sessions),
+            "state_bytes": raw_bytes / updates if updates else 0,
+            "update_bytes": sent_bytes / updates if updates else 0,
+            "bytes_per_session_second": sent_bytes / len(sessions) / seconds if sessions else 0,
+        }
+
+
+class Client:
+
+    def __init__(self, level, seed):
+        self.level = level
+        self.seed = seed
+        self.tick_time = 1 / game.TICK_RATE
+        self.inputs = headless.RandomInput(seed)
+        self.state = b""
+        self.tick = 0
+        self.updates = 0
+        self.corrupt = 0
+
+    async def run(self, host, port, seconds):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(HELLO.pack(SERVER_FORMAT, SERVER_VERSION, self.level, self.seed))
+        receiver = asyncio.create_task(self.receive(reader))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        end = deadline + seconds
+        tick = 0
+        while loop.time() < end:
+            for action, key in self.inputs.events(tick):
+                writer.write(EVENT.pack(game.REPLAY_ACTIONS.index(action), key))
+            tick += 1
+            deadline += self.tick_time
+            await asyncio.sleep(max(deadline - loop.time(), 0))
+        writer.close()
+        receiver.cancel()
+
+    async def receive(self, reader):
+        while True:
+            tick, size, checksum, length = UPDATE.unpack(await reader.readexactly(UPDATE.size))
+            self.state = undelta(self.state, await reader.readexactly(length), size)
+            self.tick = tick
+            self.updates += 1
+            self.corrupt += zlib.crc32(self.state) != checksum
+
+
+async def simulate(clients, levels, seconds, seed, tick_rate, send_interval):
+    server = Server(tick_rate, send_interval)
+    listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    ticker = asyncio.create_task(server.run())
+    simulated = [Client(levels[i % len(levels)], seed + i) for i in range(clients)]
+    cpu = time.process_time()
+    start = time.perf_counter()
+    await asyncio.gather(*(client.run("127.0.0.1", port, seconds) for client in simulated))
+    elapsed = time.perf_counter() - start
+    while server.sessions:
+        await asyncio.sleep(server.tick_time)
+    report = server.report(elapsed)
+    report["process_cpu"] = (time.process_time() - cpu) / elapsed
+    report["client_updates"] = sum(client.updates for client in simulated)
+    report["client_corrupt_updates"] = sum(client.corrupt for client in simulated)
+    ticker.cancel()
+    listener.close()
+    return report
+
+
+async def serve(host, port, tick_rate, send_interval):
+    server = Server(tick_rate, send_interval)
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"Serving World of Chaos sessions on {host}:{port}")
+    async with listener:
+        await server.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host headless World of Chaos sessions over asyncio")
+    parser.add_argument("--serve", action="store_true", help="serve real clients instead of simulating them")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--clients", type=int, default=100, help="loopback clients to simulate")
+    parser.add_argument("--level", type=int, action="append", help="level index, may be repeated")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tick-rate", type=int, default=game.TICK_RATE, help="simulation ticks per second")
+    parser.add_argument("--send-interval", type=int, default=SEND_INTERVAL, help="ticks between state updates")
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve(args.host, args.port, args.tick_rate, args.send_interval))
+        return
+    print(json.dumps(asyncio.run(simulate(args.clients, args.level or [0, 1, 2], args.seconds, args.seed,
+                                          args.tick_rate, args.send_interval))))
+
+
+if __name__ == "__main__":
+    main()
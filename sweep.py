@@ -0,0 +1,381 @@
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+import headless
+import game
+
+TABLES = ["BULLETS_SPEED", "BULLETS_DAMAGE", "BULLETS_LIFETIME", "ENEMY_HEALTH", "ENEMY_RADIOUS", "ENEMY_RELOAD"]
+DEFAULT_TABLES = {name: list(getattr(game, name)) for name in TABLES}
+
+# Загруженные миры процесса по набору таблиц, для headless.start_world
+WORLDS = {}
+
+BOT_PLAN_TICKS = 8
+BOT_SHOT_TICKS = 6
+BOT_MOVES = [None, headless.KEYS["LEFT"], headless.KEYS["RIGHT"]]
+# Прыжок поднимает на BOT_JUMP_ROWS клеток и уносит в сторону до BOT_JUMP_COLUMNS клеток
+BOT_JUMP_ROWS = 3
+BOT_JUMP_COLUMNS = 5
+# В полёте бот ищет место приземления в пределах BOT_FLIGHT_COLUMNS клеток
+BOT_FLIGHT_COLUMNS = 8
+# Бот подходит к врагу на BOT_MARGIN пикселей ближе дальности выстрела
+BOT_MARGIN = 100
+BOT_UNREACHABLE = 2000
+
+
+class BotInput:
+    # Бот планирует по снимкам мира: каждые BOT_PLAN_TICKS тиков пробует все сочетания ходьбы и прыжка,
+    # откатывает мир и выбирает лучший исход. Исход оценивается по графу клеток уровня, где рёбра - шаги,
+    # падения и прыжки, а цели - клетки на высоте врага в пределах дальности выстрела
+
+    def __init__(self, world, seed=None):
+        self.world = world
+        self.grid = world.map.grid
+        self.random = random.Random(seed)
+        self.held = None
+        self.up = False
+        self.move = None
+        self.jump = False
+        self.reach = game.per_tick(game.BULLETS_SPEED[0]) * game.tick_count(game.BULLETS_LIFETIME[0])
+        # скорость игрока в пикселях за тик и цены в тиках: шаг на клетку, прыжок, падение на клетку
+        self.speed = game.per_tick(game.PLAYER_SPEED)
+        self.walk_ticks = round(self.grid.tile_width / self.speed)
+        self.jump_ticks = game.tick_count(game.PLAYER_JUMP_TIME)
+        self.fall_ticks = round(self.grid.tile_height / game.per_tick(game.PLAYER_GRAVITY))
+        self.edges = self.graph()
+        self.cache = {}
+        self.cost = {}
+
+    def standable(self, column, row):
+        grid = self.grid
+        return 0 <= column < grid.columns and 0 < row < grid.rows and grid.at("collision", column, row) is None \
+            and grid.at("collision", column, row - 1) is not None
+
+    def landing(self, column, row):
+        if not 0 <= column < self.grid.columns:
+            return None
+        for row in range(min(row, self.grid.rows - 1), 0, -1):
+            if self.grid.at("collision", column, row) is not None:
+                return None
+            if self.grid.at("collision", column, row - 1) is not None:
+                return column, row
+        return None
+
+    def graph(self):
+        # рёбра хранятся в обратную сторону, от клетки к тем, из которых в неё можно попасть
+        edges = {}
+        for column in range(self.grid.columns):
+            for row in range(1, self.grid.rows):
+                if not self.standable(column, row):
+                    continue
+                source = column, row
+                for step in (-1, 1):
+                    if self.standable(column + step, row):
+                        edges.setdefault((column + step, row), []).append((source, self.walk_ticks))
+                    elif self.grid.at("collision", column + step, row) is None:
+                        land = self.landing(column + step, row)
+                        if land is not None:
+                            edges.setdefault(land, []).append((source, self.walk_ticks + self.fall_ticks * (row - land[1])))
+                for rise in range(-BOT_JUMP_ROWS * 2, BOT_JUMP_ROWS + 1):
+                    width = BOT_JUMP_COLUMNS - max(rise - 1, 0)
+                    for step in range(-width, width + 1):
+                        if (step or rise) and self.standable(column + step, row + rise):
+                            edges.setdefault((column + step, row + rise), []).append(
+                                (source, self.jump_ticks + self.walk_ticks * abs(step) + self.fall_ticks * max(-rise, 0)))
+        return edges
+
+    def targets(self, patrol):
+        enemies = self.world.map.enemies
+        width = self.grid.tile_width
+        cells = set()
+        for i in enemies.alive:
+            column, row = self.grid.cell(enemies.x[i], enemies.y[i])
+            cells.add((column, row))
+            left = min(enemies.x[i], enemies.patrol_left[i]) if patrol else enemies.x[i]
+            right = max(enemies.x[i], enemies.patrol_right[i]) if patrol else enemies.x[i]
+            range_ = self.reach - BOT_MARGIN
+            for column in range(int((left - range_) // width), int((right + range_) // width) + 1):
+                if self.standable(column, row):
+                    cells.add((column, row))
+        return frozenset(cells)
+
+    def costs(self, targets):
+        if targets not in self.cache:
+            cost = dict.fromkeys(targets, 0)
+            queue = [(0, cell) for cell in targets]
+            while queue:
+                ticks, cell = heapq.heappop(queue)
+                if ticks > cost[cell]:
+                    continue
+                for source, step in self.edges.get(cell, ()):
+                    if ticks + step < cost.get(source, float("inf")):
+                        cost[source] = ticks + step
+                        heapq.heappush(queue, (ticks + step, source))
+            self.cache[targets] = cost
+        return self.cache[targets]
+
+    def distance(self):
+        sprite = self.world.player.player_sprite
+        land = self.landing(*self.grid.cell(sprite.center_x, sprite.bottom + 8))
+        return BOT_UNREACHABLE if land is None else self.cost.get(land, BOT_UNREACHABLE)
+
+    def flight(self, rise):
+        # лучшая клетка, до которой можно долететь по дуге прыжка, пока игрок не опустится до её высоты
+        sprite = self.world.player.player_sprite
+        top = sprite.bottom + game.per_tick(game.PLAYER_JUMP_POWER - game.PLAYER_GRAVITY) * rise
+        row = int(top // self.grid.tile_height)
+        column = int(sprite.center_x // self.grid.tile_width)
+        width = self.grid.tile_width
+        best = None
+        for column in range(column - BOT_FLIGHT_COLUMNS, column + BOT_FLIGHT_COLUMNS + 1):
+            land = self.landing(column, row)
+            if land is None:
+                continue
+            ticks = rise + max(top - land[1] * self.grid.tile_height, 0) / game.per_tick(game.PLAYER_GRAVITY)
+            gap = max(column * width - sprite.center_x, sprite.center_x - (column + 1) * width) - sprite.width / 2
+            if gap <= self.speed * ticks:
+                cost = self.cost.get(land, BOT_UNREACHABLE) + ticks
+                best = cost if best is None else min(best, cost)
+        return best
+
+    def score(self):
+        player = self.world.player
+        enemies = self.world.map.enemies
+        if player.game_win:
+            return 1e9 - self.world.ticks
+        if player.game_lose:
+            return -1e9
+        # с земли можно и остаться на месте, и сразу прыгнуть
+        if player.on_ground:
+            distance = min(self.distance(), self.flight(self.jump_ticks) or BOT_UNREACHABLE)
+        else:
+            distance = self.flight(player.jump_timer if player.jumping else 0)
+        if distance is None:
+            return -1e8
+        return -1000 * enemies.alive_count - 5 * sum(enemies.health[i] for i in enemies.alive) \
+            + 2 * player.health - distance + self.aim()
+
+    def aim(self):
+        # на высоте врага выгодно смотреть на него и стоять на дальности выстрела
+        player = self.world.player
+        sprite = player.player_sprite
+        enemies = self.world.map.enemies
+        best = 0
+        for i in enemies.alive:
+            dx = enemies.x[i] - sprite.center_x
+            if abs(enemies.y[i] - sprite.center_y) < game.BULLETS_RADIUS - 5:
+                best = max(best, 40 * ((dx > 0) == player.direction) - 0.5 * max(abs(dx) - self.reach + BOT_MARGIN, 0))
+        return best
+
+    def shoot(self, tick):
+        player = self.world.player
+        sprite = player.player_sprite
+        enemies = self.world.map.enemies
+        if tick % BOT_SHOT_TICKS:
+            return []
+        height = game.BULLETS_RADIUS * (3 if player.big_bullets_timer > 0 else 1) - 5
+        for i in enemies.alive:
+            dx = enemies.x[i] - sprite.center_x
+            if abs(enemies.y[i] - sprite.center_y) < height and abs(dx) < self.reach + game.BULLETS_RADIUS \
+                    and (dx > 0) == player.direction:
+                return [("press", headless.KEYS["SPACE"])]
+        return []
+
+    def act(self, tick, move, jump):
+        events = []
+        if move != self.held:
+            if self.held is not None:
+                events.append(("release", self.held))
+            if move is not None:
+                events.append(("press", move))
+            self.held = move
+        player = self.world.player
+        if jump and player.on_ground and not player.jumping:
+            events.append(("press", headless.KEYS["UP"]))
+            self.up = True
+        elif not jump and self.up:
+            events.append(("release", headless.KEYS["UP"]))
+            self.up = False
+        return events + self.shoot(tick)
+
+    def plan(self, tick):
+        world = self.world
+        # сначала цели там, где враги сейчас; если туда не добраться, то вдоль их маршрутов патрулирования
+        if len(self.cache) > 64:
+            self.cache.clear()
+        self.cost = self.costs(self.targets(False))
+        if self.distance() >= BOT_UNREACHABLE:
+            self.cost = self.costs(self.targets(True))
+        snapshot = world.snapshot()
+        held = self.held, self.up
+        best = None
+        for move in BOT_MOVES:
+            for jump in (False, True):
+                for t in range(tick, tick + BOT_PLAN_TICKS):
+                    world.apply(self.act(t, move, jump))
+                    if not world.tick():
+                        break
+                # случайная добавка разводит равные варианты, поэтому прогоны с разными seed отличаются
+                score = self.score() + self.random.random() * 5
+                if best is None or score > best[0]:
+                    best = score, move, jump
+                world.restore(snapshot)
+                self.held, self.up = held
+        _, self.move, self.jump = best
+
+    def events(self, tick):
+        if tick % BOT_PLAN_TICKS == 0:
+            self.plan(tick)
+        return self.act(tick, self.move, self.jump)
+
+
+def is_recording(name):
+    with open(name, "rb") as file:
+        return file.read(len(game.REPLAY_FORMAT)) == game.REPLAY_FORMAT
+
+
+def new_inputs(name, world, seed):
+    if name == "bot":
+        return BotInput(world, seed)
+    if name == "random":
+        return headless.RandomInput(seed)
+    if is_recording(name):
+        return game.Recording.load(name)
+    return headless.ScriptedInput.from_file(name)
+
+
+def scaled(name, factor):
+    return [round(value * factor) if isinstance(value, int) else value * factor for value in DEFAULT_TABLES[name]]
+
+
+def parameter_grid(scales, grid_file):
+    axes = []
+    for spec in scales:
+        name, factors = spec.split("=")
+        axes.append([(f"{name} x{factor}", {name: scaled(name, float(factor))}) for factor in factors.split(",")])
+    if grid_file:
+        with open(grid_file) as file:
+            for name, tables in json.load(file).items():
+                axes.append([(f"{name} #{index}", {name: table}) for index, table in enumerate(tables)])
+    grid = []
+    for combination in itertools.product(*axes):
+        labels = [label for label, _ in combination]
+        tables = {}
+        for _, table in combination:
+            tables.update(table)
+        grid.append((", ".join(labels) or "defaults", tables))
+    return grid
+
+
+def start_world(level, label, seed):
+    # снимок зависит от таблиц; задачи идут по порядку параметров, поэтому миры прошлого набора не нужны
+    if label not in WORLDS:
+        WORLDS.clear()
+        WORLDS[label] = {}
+    return headless.start_world(level, seed, WORLDS[label])
+
+
+def simulate(task):
+    level, label, tables, inputs, seed, ticks = task
+    for name in TABLES:
+        setattr(game, name, tables.get(name, DEFAULT_TABLES[name]))
+    world = start_world(level, label, seed)
+    source = new_inputs(inputs, world, seed)
+    events = source.events_at if isinstance(source, game.Recording) else source.events
+    for tick in range(ticks):
+        world.apply(events(tick))
+        if not world.tick():
+            break
+    return {
+        "level": level,
+        "parameters": label,
+        "inputs": inputs,
+        "seed": seed,
+        "win": world.player.game_win,
+        # падение за край карты убивает без урона, поэтому смерти и падения считаются отдельно от damage_taken
+        "death": world.player.game_lose,
+        "fell": world.player.game_lose and world.player.player_sprite.top < 0,
+        "ticks": world.ticks,
+        "damage_taken": world.player.damage_taken,
+    }
+
+
+def aggregate(results):
+    groups = {}
+    for result in results:
+        groups.setdefault((result["parameters"], result["level"], result["inputs"]), []).append(result)
+    rows = []
+    for (parameters, level, inputs), runs in sorted(groups.items()):
+        wins = [run for run in runs if run["win"]]
+        rows.append({
+            "parameters": parameters,
+            "level": level,
+            "inputs": inputs,
+            "runs": len(runs),
+            "win_rate": len(wins) / len(runs),
+            "death_rate": sum(run["death"] for run in runs) / len(runs),
+            "fall_rate": sum(run["fell"] for run in runs) / len(runs),
+            "clear_ticks": sum(run["ticks"] for run in wins) / len(wins) if wins else None,
+            "damage_taken": sum(run["damage_taken"] for run in runs) / len(runs),
+        })
+    return rows
+
+
+def print_table(rows):
+    width = max([len(row["parameters"]) for row in rows] + [10])
+    print(f"{'parameters':<{width}} {'level':>5} {'inputs':>8} {'runs':>5} {'win':>6} {'death':>6} {'fall':>6} {'clear':>8} {'damage':>8}")
+    for row in rows:
+        clear = "-" if row["clear_ticks"] is None else f"{row['clear_ticks']:.0f}"
+        print(f"{row['parameters']:<{width}} {row['level']:>5} {row['inputs'][-8:]:>8} {row['runs']:>5} "
+              f"{row['win_rate']:>6.0%} {row['death_rate']:>6.0%} {row['fall_rate']:>6.0%} {clear:>8} "
+              f"{row['damage_taken']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep balance tables over headless World of Chaos runs")
+    parser.add_argument("--level", type=int, action="append", help="level index, may be repeated")
+    parser.add_argument("--scale", action="append", default=[],
+                        help="NAME=f1,f2,... multiplies a BULLETS_*/ENEMY_* table by each factor")
+    parser.add_argument("--grid", help="JSON object mapping a table name to a list of full tables")
+    parser.add_argument("--inputs", nargs="+", default=["bot"],
+                        help="bot, random, a script JSON file or a recorded run (played on its own level and seed)")
+    parser.add_argument("--seeds", type=int, default=4, help="runs per level, parameters and inputs")
+    parser.add_argument("--ticks", type=int, default=6000, help="tick limit per run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", help="write the aggregated table as CSV")
+    args = parser.parse_args()
+
+    runs = []
+    for inputs in args.inputs:
+        if inputs not in ("bot", "random") and is_recording(inputs):
+            recording = game.Recording.load(inputs)
+            runs.append((recording.level, inputs, recording.seed))
+        else:
+            runs.extend((level, inputs, seed) for level in args.level or [0, 1, 2] for seed in range(args.seeds))
+    tasks = [(level, label, tables, inputs, seed, args.ticks)
+             for label, tables in parameter_grid(args.scale, args.grid)
+             for level, inputs, seed in runs]
+    start = time.perf_counter()
+    with Pool(args.workers) as pool:
+        results = list(pool.imap_unordered(simulate, tasks, chunksize=max(len(tasks) // (args.workers * 4), 1)))
+    rows = aggregate(results)
+    print_table(rows)
+    print(f"{len(tasks)} runs on {args.workers} workers in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()